@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# Measure the overhead of nino itself and how it scales with the amount of projects, entirely offline.
+# Every project gets a local bare git remote and the toolchain is replaced by stubs that only wait a
+# configurable amount of time, so whatever is left is the cost of the orchestration.
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+# Repository root, so the working tree is what gets measured instead of an installed nino
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = ["gradle", "gradlew", "apksigner", "keytool", "zipalign", "adb"]
+STAGES = ["sync", "build", "sign", "deploy"]
+
+# Shared by every stub: log the call, wait the configured latency and do the minimum the real tool would
+STUB = '''#!{python}
+import os, sys, time, zipfile
+tool = {tool!r}
+with open(os.environ["NINO_BENCH_CALLS"], "a") as file:
+	file.write(tool + "\\n")
+time.sleep(float(os.environ.get("NINO_BENCH_" + tool.upper(), "0")))
+arguments = sys.argv[1:]
+if tool in ["gradle", "gradlew"]:
+	# Drop an unsigned apk for every assemble task, where gradle would
+	for task in [task for task in arguments if task.startswith("assemble")]:
+		variant = task[len("assemble"):].lower() or "release"
+		folder = os.path.join("app", "build", "outputs", "apk", variant)
+		os.makedirs(folder, exist_ok = True)
+		with zipfile.ZipFile(os.path.join(folder, "app-" + variant + "-unsigned.apk"), "w") as apk:
+			apk.writestr("AndroidManifest.xml", b"\\0" * 64)
+			apk.writestr("classes.dex", os.urandom(4096))
+elif tool == "apksigner":
+	if arguments[0] == "verify":
+		sys.exit(1)
+	sys.stdin.read()
+	with open(arguments[arguments.index("--in") + 1], "rb") as source, open(arguments[arguments.index("--out") + 1], "wb") as target:
+		target.write(source.read())
+elif tool == "keytool":
+	sys.stdin.read()
+	if "-destkeystore" in arguments:
+		open(arguments[arguments.index("-destkeystore") + 1], "w").close()
+elif tool == "adb":
+	if arguments[:1] == ["devices"]:
+		print("List of devices attached\\nBENCH1\\tdevice transport_id:1\\n")
+	elif "features" in arguments:
+		print("shell_v2")
+'''
+
+CONFIG = '''buildjobs = {buildjobs}
+syncjobs = {syncjobs}
+
+[keystores.bench]
+path = "bench.jks"
+password = "bench"
+[keystores.bench.aliases.key]
+name = "key"
+password = "bench"
+
+[devices]
+phones = ["BENCH1"]
+
+[projects.default]
+sync = true
+followtags = false
+build = true
+keystore = "bench"
+keyalias = "key"
+deploy = ["phones"]
+'''
+
+def git(*arguments, cwd = None):
+	subprocess.run(["git"] + list(arguments), cwd = cwd, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+
+def toolchain(root):
+	folder = os.path.join(root, "bin")
+	os.makedirs(folder)
+	for tool in TOOLS:
+		with open(os.path.join(folder, tool), "w") as file:
+			file.write(STUB.format(python = sys.executable, tool = tool))
+		os.chmod(os.path.join(folder, tool), 0o755)
+	return folder
+
+def generate(root, count, options):
+	# Seeds are where new commits are made and pushed from, work is what nino runs on
+	for folder in ["remotes", "seeds", "work"]:
+		os.makedirs(os.path.join(root, folder))
+	bin = toolchain(root)
+	for index in range(count):
+		name = "project" + format(index, "03")
+		remote, seed = os.path.join(root, "remotes", name + ".git"), os.path.join(root, "seeds", name)
+		git("init", "-q", "--bare", remote)
+		git("clone", "-q", remote, seed)
+		shutil.copy(os.path.join(bin, "gradlew"), os.path.join(seed, "gradlew"))
+		git("add", "gradlew", cwd = seed)
+		git("commit", "-q", "-m", "initial", cwd = seed)
+		git("push", "-q", "origin", "HEAD", cwd = seed)
+		git("clone", "-q", remote, os.path.join(root, "work", name))
+	with open(os.path.join(root, "work", "nino.toml"), "w") as file:
+		file.write(CONFIG.format(buildjobs = options.buildjobs, syncjobs = options.syncjobs))
+	open(os.path.join(root, "work", "bench.jks"), "w").close()
+
+def advance(root):
+	# A new commit on every remote so the next run has to sync, build, sign and deploy everything
+	for name in os.listdir(os.path.join(root, "seeds")):
+		seed = os.path.join(root, "seeds", name)
+		git("commit", "-q", "--allow-empty", "-m", "update", cwd = seed)
+		git("push", "-q", "origin", "HEAD", cwd = seed)
+
+def measure(root, options):
+	calls = os.path.join(root, "calls")
+	open(calls, "w").close()
+	env = dict(os.environ, PATH = os.path.join(root, "bin") + os.pathsep + os.environ["PATH"], PYTHONPATH = ROOT, NINO_BENCH_CALLS = calls)
+	env.update({"NINO_BENCH_" + tool.upper(): str(options.latency.get(tool, 0)) for tool in TOOLS})
+	start = time.perf_counter()
+	result = subprocess.run([sys.executable, "-c", "import nino; nino.main()"], cwd = os.path.join(root, "work"), env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+	wall = time.perf_counter() - start
+	# nino keeps the totals of every stage on its history of runs
+	with open(os.path.join(root, "work", ".nino-runs"), "r") as file:
+		summary = json.loads(file.readlines()[-1])
+	with open(calls, "r") as file:
+		tools = [line.strip() for line in file]
+	stages = {kind: round(sum(totals.get(kind, 0) for totals in summary["projects"].values()), 3) for kind in STAGES}
+	return {"wall": round(wall, 3), "status": result.returncode, "stages": stages, "processes": summary.get("children", 0), "tools": {tool: tools.count(tool) for tool in TOOLS if tool in tools}}
+
+def scenario(count, options):
+	root = tempfile.mkdtemp(prefix = "nino-bench-")
+	try:
+		generate(root, count, options)
+		results = {}
+		# Everything new, then nothing new at all, which is what most nights look like
+		advance(root)
+		results["changed"] = measure(root, options)
+		results["unchanged"] = measure(root, options)
+		return results
+	finally:
+		if not options.keep:
+			shutil.rmtree(root, ignore_errors = True)
+		else:
+			print("Kept generated projects on " + root)
+
+def latencies(text):
+	# gradlew=2,adb=0.5 means each call to those stubs takes that many seconds
+	values = {}
+	for pair in [pair for pair in text.split(",") if pair]:
+		tool, seconds = pair.split("=")
+		values[tool] = float(seconds)
+	if "gradlew" in values:
+		values.setdefault("gradle", values["gradlew"])
+	return values
+
+def compare(results, baseline, tolerance):
+	# Anything slower than the baseline by more than the tolerance is a regression
+	regressions = []
+	for count in [count for count in results if count in baseline]:
+		for name in results[count]:
+			old, new = baseline[count].get(name), results[count][name]
+			if not old:
+				continue
+			if new["wall"] > old["wall"] * (1 + tolerance):
+				regressions.append(count + " projects, " + name + ": " + str(old["wall"]) + "s -> " + str(new["wall"]) + "s")
+			if new["processes"] > old["processes"]:
+				regressions.append(count + " projects, " + name + ": " + str(old["processes"]) + " -> " + str(new["processes"]) + " processes")
+	return regressions
+
+def alignment(size, keep):
+	# Realign a large unsigned apk in process and with zipalign, when the real one is installed
+	sys.path.insert(0, ROOT)
+	from nino import apk
+	root = tempfile.mkdtemp(prefix = "nino-align-")
+	source = os.path.join(root, "unaligned.apk")
+	# Odd sized stored entries push everything after them out of place, like resources and native libraries do
+	with zipfile.ZipFile(source, "w") as archive:
+		archive.writestr("AndroidManifest.xml", b"\0" * 64, zipfile.ZIP_DEFLATED)
+		for index in range(size):
+			archive.writestr("assets/blob" + str(index), os.urandom(1048576 - 1), zipfile.ZIP_STORED)
+			archive.writestr("lib/arm64-v8a/lib" + str(index) + ".so", os.urandom(65536 + 3), zipfile.ZIP_STORED)
+			archive.writestr("res/raw/file" + str(index), os.urandom(8192), zipfile.ZIP_DEFLATED)
+	results = {}
+	shutil.copy(source, os.path.join(root, "nino.apk"))
+	start = time.perf_counter()
+	wrong = apk.realign(os.path.join(root, "nino.apk"))
+	results["nino"] = {"wall": round(time.perf_counter() - start, 3), "entries": len(wrong or [])}
+	# The stub of the other benchmark does not count, only a zipalign that really aligns is worth comparing
+	zipalign = shutil.which("zipalign")
+	if zipalign and not os.path.dirname(zipalign).startswith(tempfile.gettempdir()):
+		start = time.perf_counter()
+		status = subprocess.run([zipalign, "-f", "-p", "4", source, os.path.join(root, "zipalign.apk")], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL).returncode
+		results["zipalign"] = {"wall": round(time.perf_counter() - start, 3), "status": status}
+	# Both outputs must hold the very same entries, only aligned
+	with zipfile.ZipFile(os.path.join(root, "nino.apk")) as archive:
+		results["nino"]["valid"] = archive.testzip() is None and not apk.misaligned(apk.archive(os.path.join(root, "nino.apk")))
+	print("apk of " + str(os.path.getsize(source) // 1048576) + " MiB")
+	for name, result in results.items():
+		print(format(name, "<10") + format(format(result["wall"], ".2f") + "s", "<10") + ", ".join(key + "=" + str(value) for key, value in result.items() if key != "wall"))
+	if keep:
+		print("Kept generated apks on " + root)
+	else:
+		shutil.rmtree(root, ignore_errors = True)
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description = "Benchmark nino against synthetic projects and a stand-in toolchain")
+	parser.add_argument("-n", "--projects", default = "1,10,50", help = "Comma separated amounts of projects to measure (default 1,10,50)")
+	parser.add_argument("-l", "--latency", type = latencies, default = {}, help = "Seconds each stub takes, like gradlew=2,apksigner=0.5,adb=0.2")
+	parser.add_argument("-j", "--syncjobs", type = int, default = 4, help = "syncjobs for the generated configuration")
+	parser.add_argument("-b", "--buildjobs", type = int, default = 1, help = "buildjobs for the generated configuration")
+	parser.add_argument("--save", help = "Write the results as json to this file")
+	parser.add_argument("--compare", help = "Fail if slower than the results saved on this file")
+	parser.add_argument("--tolerance", type = float, default = 0.2, help = "Allowed slowdown over the compared results (default 0.2)")
+	parser.add_argument("--keep", action = "store_true", help = "Keep the generated projects for inspection")
+	parser.add_argument("--align", type = int, metavar = "MIB", help = "Only measure realigning an apk of about this many MiB, against zipalign if installed")
+	options = parser.parse_args()
+
+	if options.align:
+		results = alignment(options.align, options.keep)
+		if options.save:
+			with open(options.save, "w") as file:
+				json.dump(results, file, indent = '\t')
+		return
+
+	results = {}
+	print("projects  scenario    wall      sync      build     sign      deploy    processes  tool calls")
+	for count in [int(count) for count in options.projects.split(",")]:
+		results[str(count)] = scenario(count, options)
+		for name, result in results[str(count)].items():
+			print(format(count, "<10") + format(name, "<12") + "".join(format(format(value, ".2f") + "s", "<10") for value in [result["wall"]] + [result["stages"][kind] for kind in STAGES]) + format(result["processes"], "<11") + " ".join(tool + "=" + str(amount) for tool, amount in result["tools"].items()) + ("" if result["status"] == 0 else " (nino exited with " + str(result["status"]) + ")"))
+
+	if options.save:
+		with open(options.save, "w") as file:
+			json.dump(results, file, indent = '\t')
+	if options.compare:
+		with open(options.compare, "r") as file:
+			regressions = compare(results, json.load(file), options.tolerance)
+		for regression in regressions:
+			print("REGRESSION: " + regression)
+		if regressions:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,81 @@
+// Long lived signer used by nino so a whole run costs one JVM per key instead of two per apk.
+// Run as a single source file against the apksig library shipped with the build tools:
+//     java -cp apksigner.jar NinoSigner.java KEYSTORE ALIAS WORKERS
+// The keystore and key passwords are read from the first two lines of stdin and never leave this process.
+// Requests are read one per line as "ID<TAB>INPUT<TAB>OUTPUT" and answered, in any order, as "ID<TAB>STATUS[<TAB>DETAILS]".
+import com.android.apksig.ApkSigner;
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.security.KeyStore;
+import java.security.PrivateKey;
+import java.security.cert.Certificate;
+import java.security.cert.X509Certificate;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+
+public class NinoSigner {
+    private static final PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, StandardCharsets.UTF_8);
+
+    public static void main(String[] args) throws Exception {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        final ApkSigner.SignerConfig key;
+        try {
+            key = load(new File(args[0]), args[1], in.readLine().toCharArray(), in.readLine().toCharArray());
+        } catch (Exception e) {
+            reply("ERROR", e);
+            return;
+        }
+        reply("READY", null);
+        ExecutorService workers = Executors.newFixedThreadPool(Integer.parseInt(args[2]));
+        String line;
+        while ((line = in.readLine()) != null) {
+            final String[] request = line.split("\t");
+            workers.submit(() -> {
+                try {
+                    new ApkSigner.Builder(List.of(key)).setInputApk(new File(request[1])).setOutputApk(new File(request[2])).build().sign();
+                    reply(request[0] + "\tSIGNED", null);
+                } catch (Throwable e) {
+                    reply(request[0] + "\tFAILED", e);
+                }
+            });
+        }
+        // Our stdin was closed so nino has nothing else for us, finish what is pending and leave
+        workers.shutdown();
+        workers.awaitTermination(1, TimeUnit.DAYS);
+    }
+
+    private static ApkSigner.SignerConfig load(File path, String alias, char[] storepass, char[] keypass) throws Exception {
+        try {
+            // The type of the keystore (JKS, PKCS12) is detected from its contents
+            KeyStore store = KeyStore.getInstance(path, storepass);
+            PrivateKey key = (PrivateKey) store.getKey(alias, keypass);
+            Certificate[] chain = store.getCertificateChain(alias);
+            if (key == null || chain == null) {
+                throw new IllegalArgumentException("alias " + alias + " does not exist or has no private key");
+            }
+            List<X509Certificate> certificates = new ArrayList<>();
+            for (Certificate certificate : chain) {
+                certificates.add((X509Certificate) certificate);
+            }
+            return new ApkSigner.SignerConfig.Builder("CERT", key, certificates).build();
+        } finally {
+            Arrays.fill(storepass, '\0');
+            Arrays.fill(keypass, '\0');
+        }
+    }
+
+    private static void reply(String message, Throwable error) {
+        synchronized (out) {
+            out.println(error == null ? message : message + "\t" + String.valueOf(error).replace('\n', ' ').replace('\t', ' '));
+        }
+    }
+}
@@ -1,53 +1,110 @@
 import os
+import sys
 import json
 from .project import project
-from .utils import dpnds, cprint
-from .statics import projects, workdir
-from .config import running, retryconfig, failed
+from .pipeline import pipeline
+from .cache import cache
+from .releases import releases, listing
+from .devices import devices
+from .keystores import keys
+from . import gradlecache
+from .watch import watcher, control
+from .metrics import recorder, report
+from .planner import estimate, show
+from .utils import dpnds
+from .config import running, retryconfig, failed, projects, arguments, load, setup, ninoerror
 
 def main():
+	# Embedders get the error, from the command line it ends nino
+	try:
+		command(arguments())
+	except ninoerror as error:
+		print(error)
+		sys.exit(1)
+
+def command(options):
+	# Reports only read what previous runs left behind
+	if options.get("report", False):
+		report(os.getcwd())
+		return
+	if options.get("releases", False):
+		listing(os.getcwd())
+		return
+	if options.get("control", False):
+		control(os.getcwd(), options["control"])
+		return
+	if options.get("daemon", False):
+		daemon(load(options), options)
+		return
+	if options.get("gradlecacheview", False) or "evict" in options:
+		gradle(load(options), options)
+		return
+	if options.get("plan", False):
+		plan(load(options), options)
+		return
+	run(load(options), options)
+
+def plan(config, options = {}, path = None):
+	# Dry run: show in which order projects would be handled and when everything would be done, touching nothing
+	setup(config, options, path)
+	show([project(name) for name in projects if not running["retry"] or name in running["projects"]])
+
+def gradle(config, options = {}, path = None):
+	# Look after the shared gradle cache without running anything
+	setup(config, options, path)
+	if "evict" in options:
+		gradlecache.evict(gradlecache.home(), options["evict"])
+	gradlecache.show(gradlecache.home())
+
+def run(config, options = {}, path = None):
+	# Entry point for embedding: config has the layout of nino.toml and options the names of the command line arguments
+	prepare(config, options, path)
+	# Initialize project class for every folder on invocation dir, skipping them if retrying but nothing to do
+	cycle([name for name in projects if not running["retry"] or name in running["projects"]])
+
+def daemon(config, options = {}, path = None):
+	# Same as a run but staying around, so configuration and unlocked keys are kept between runs
+	prepare(config, options, path)
+	watcher(cycle).run()
+
+def prepare(config, options = {}, path = None):
+	setup(config, options, path)
 	# Check everything is in place before even starting to retrieve information
 	dpnds()
 
 	# Create the out directory in case it doesn't exist already
-	if not os.path.isdir("NINO-RELEASES"):
-		os.mkdir("NINO-RELEASES")
-
-	# Loop for every folder on invocation dir
-	for name in projects:
-		# Skip project if retrying but nothing to do
-		if running["retry"] and name not in running["projects"]:
-			continue
-		os.chdir(name)
-		# Initialize project class
-		app = project(name)
-		# Introduce the project
-		app.presentation()
-		# If the project is set for retry skip normal execution and save previous config
-		if name in retryconfig and not app.force:
-			cprint("Project is set for retry, skipping.", "warning")
-			cprint("Once fixed, rebuild via 'nino -r' or 'nino -f " + name, "warning")
-			app.failed = retryconfig[name]
-		else:
-			# Initialize logging to file for output of each operation
-			with open("log.txt", "w+") as app.logfile:
-				# Sync the project
-				if app.sync:
-					app.fetch()
-				# Only attempt gradle projects with build enabled and are either forced or have new changes
-				if app.build and (app.changed or app.force):
-					app.package()
-				# We search for apks to sign and merge them to the current list
-				if app.built == 0 or app.signlist:
-					app.sign()
-				# We deploy if we built something
-				if app.deploylist:
-					app.install()
-		# Store retriable config for project if not empty
+	if not os.path.isdir(os.path.join(running["workdir"], "NINO-RELEASES")):
+		os.mkdir(os.path.join(running["workdir"], "NINO-RELEASES"))
+
+def cycle(names, forced = (), retried = ()):
+	# Handle the given projects from start to end, forcing or retrying some of them on request
+	recorder.begin()
+	# What devices are attached and what they have installed may have changed since the last time
+	devices.reset()
+	keys.reset()
+	apps = [project(name, name in forced, retryconfig.get(name) if name in retried else None) for name in names]
+
+	# Expected duration of each project according to previous runs, so the longest ones start first
+	estimates = estimate(apps)
+
+	# Sync, build, sign and deploy as a pipeline, each project moving to the next stage as soon as it is done with the previous one
+	pipeline(apps, estimates).run()
+
+	# Persist the outputs of this run for future identical builds
+	cache.save()
+	# Apply retention to the release store and record what was released
+	releases.save()
+
+	# Store retriable config for every project if not empty, projects that went fine are no longer pending
+	for app in apps:
 		if app.failed:
-			failed["projects"][name] = app.failed
-		# Go back to the invocation directory before moving onto the next project
-		os.chdir(workdir)
+			retryconfig[app.name] = app.failed
+		else:
+			retryconfig.pop(app.name, None)
+	failed["projects"] = {"default": {}}
+	failed["projects"].update({name: retryconfig[name] for name in projects if name in retryconfig})
 	# Save the report to file
-	with open(".nino-last", "w") as file:
+	with open(os.path.join(running["workdir"], ".nino-last"), "w") as file:
 		json.dump(failed, file, indent='\t')
+	# Time spent on each stage goes to the console and to the history of runs
+	recorder.finish()
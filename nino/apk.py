@@ -0,0 +1,315 @@
+import os
+import re
+import zlib
+import mmap
+import struct
+import hashlib
+import zipfile
+
+# Identifiers of the blocks holding v2 and v3 signatures inside the APK Signing Block
+SIGNATUREBLOCKS = {0x7109871a: "v2", 0xf05368c0: "v3", 0x1b93ad61: "v3.1"}
+# Resource identifier of the android:versionCode attribute
+VERSIONCODE = 0x0101021b
+# Stored entries must start on a 4 bytes boundary to be mapped in place, native libraries on a page boundary
+ALIGNMENT = 4
+PAGE = 4096
+# Extra field Android tools use to pad local headers, holding the alignment the entry was given
+PADDING = 0xd935
+
+def strings(data, offset):
+	# Decode the string pool chunk of a binary xml document
+	count, flags, start = struct.unpack_from("<I4xII", data, offset + 8)
+	utf8 = flags & 0x100
+	pool = []
+	for index in range(count):
+		position = offset + start + struct.unpack_from("<I", data, offset + 28 + index * 4)[0]
+		if utf8:
+			# Skip the length in characters, then read the length in bytes
+			position += 2 if data[position] & 0x80 else 1
+			length = data[position]
+			if length & 0x80:
+				length = ((length & 0x7f) << 8) | data[position + 1]
+				position += 1
+			pool.append(data[position + 1:position + 1 + length].decode('utf-8', 'replace'))
+		else:
+			length = struct.unpack_from("<H", data, position)[0]
+			if length & 0x8000:
+				length = ((length & 0x7fff) << 16) | struct.unpack_from("<H", data, position + 2)[0]
+				position += 2
+			pool.append(data[position + 2:position + 2 + length * 2].decode('utf-16-le', 'replace'))
+	return pool
+
+def archive(path):
+	# Map the whole apk in memory, pages are only read from disk when touched
+	with open(path, "rb") as file:
+		return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+def directory(data):
+	# Find the end of central directory record, which may be followed by a comment of up to 65535 bytes
+	end = data.rfind(b"PK\x05\x06", max(0, len(data) - 65557))
+	if end < 0:
+		raise zipfile.BadZipFile("end of central directory not found")
+	count, size, offset = struct.unpack_from("<HII", data, end + 10)
+	return count, size, offset
+
+def entries(data):
+	# Walk the central directory without extracting anything, yielding name and where to find the data
+	count, size, offset = directory(data)
+	for index in range(count):
+		if data[offset:offset + 4] != b"PK\x01\x02":
+			raise zipfile.BadZipFile("bad central directory entry")
+		flags, method, compressed, length, extra, comment, local = struct.unpack_from("<2xHH8xI4xHHH8xI", data, offset + 6)
+		name = data[offset + 46:offset + 46 + length].decode('utf-8' if flags & 0x800 else 'cp437', 'replace')
+		yield name, (method, compressed, local)
+		offset += 46 + length + extra + comment
+
+def records(data):
+	# Everything needed to copy each entry as is, in the order of the central directory
+	count, size, offset = directory(data)
+	for index in range(count):
+		if data[offset:offset + 4] != b"PK\x01\x02":
+			raise zipfile.BadZipFile("bad central directory entry")
+		flags, method, compressed, length, extra, comment, local = struct.unpack_from("<2xHH8xI4xHHH8xI", data, offset + 6)
+		if compressed == 0xffffffff or local == 0xffffffff:
+			raise zipfile.BadZipFile("zip64 entries are not supported")
+		yield {"name": data[offset + 46:offset + 46 + length], "flags": flags, "method": method, "compressed": compressed, "local": local, "central": offset, "length": 46 + length + extra + comment}
+		offset += 46 + length + extra + comment
+
+def boundary(record):
+	# Compressed entries are never mapped so only stored ones care about where they start
+	if record["method"] != 0:
+		return 1
+	return PAGE if record["name"].endswith(b".so") else ALIGNMENT
+
+def misaligned(data):
+	# Names of the stored entries that do not start where the device expects them
+	wrong = []
+	for record in records(data):
+		length, extra = struct.unpack_from("<HH", data, record["local"] + 26)
+		if (record["local"] + 30 + length + extra) % boundary(record):
+			wrong.append(record["name"].decode("utf-8", "replace"))
+	return wrong
+
+def padded(extra, position, alignment):
+	# Drop the padding of a previous alignment, zipalign leaves plain zeroes and Android tools their own field
+	fields, offset = b"", 0
+	while offset + 4 <= len(extra):
+		identifier, size = struct.unpack_from("<HH", extra, offset)
+		if offset + 4 + size > len(extra):
+			break
+		if identifier not in [0, PADDING]:
+			fields += extra[offset:offset + 4 + size]
+		offset += 4 + size
+	if alignment == 1:
+		return fields
+	# The padding field itself takes at least six bytes before the entry data starts
+	padding = (alignment - (position + len(fields) + 6) % alignment) % alignment
+	return fields + struct.pack("<HHH", PADDING, 2 + padding, alignment) + b"\0" * padding
+
+def align(data, target):
+	# Copy the entries one at a time into the target, only the local headers and the central directory change
+	count, size, start = directory(data)
+	moved, written = {}, 0
+	with open(target, "wb") as file:
+		for record in sorted(records(data), key = lambda record: record["local"]):
+			if data[record["local"]:record["local"] + 4] != b"PK\x03\x04":
+				raise zipfile.BadZipFile("bad local file header")
+			length, extra = struct.unpack_from("<HH", data, record["local"] + 26)
+			name = record["local"] + 30 + length
+			body = name + extra
+			end = body + record["compressed"]
+			# Sizes of entries written while streaming follow the data, with or without their own signature
+			if record["flags"] & 0x08:
+				end += 16 if data[end:end + 4] == b"PK\x07\x08" else 12
+			fields = padded(data[name:body], written + 30 + length, boundary(record))
+			moved[record["local"]] = written
+			file.write(data[record["local"]:record["local"] + 26] + struct.pack("<HH", length, len(fields)) + data[record["local"] + 30:name] + fields)
+			written += 30 + length + len(fields)
+			for offset in range(body, end, 1048576):
+				file.write(data[offset:min(offset + 1048576, end)])
+			written += end - body
+		# Same central directory pointing to where each entry ended up
+		for record in records(data):
+			file.write(data[record["central"]:record["central"] + 42] + struct.pack("<I", moved[record["local"]]) + data[record["central"] + 46:record["central"] + record["length"]])
+		end = data.rfind(b"PK\x05\x06", max(0, len(data) - 65557))
+		file.write(data[end:end + 16] + struct.pack("<I", written) + data[end + 20:])
+
+def realign(path):
+	# Align an unsigned output in place, returning the entries that were wrong before
+	try:
+		data = archive(path)
+	except (OSError, ValueError):
+		return None
+	try:
+		wrong = misaligned(data)
+		if wrong:
+			align(data, path + ".aligned")
+	except (zipfile.BadZipFile, IndexError, struct.error, OSError):
+		wrong = None
+	finally:
+		data.close()
+	if wrong:
+		os.replace(path + ".aligned", path)
+	elif os.path.exists(path + ".aligned"):
+		os.remove(path + ".aligned")
+	return wrong
+
+def read(data, entry):
+	# Contents of a single entry, only stored and deflated ones are found on apks
+	method, compressed, local = entry
+	length, extra = struct.unpack_from("<HH", data, local + 26)
+	start = local + 30 + length + extra
+	if method == 0:
+		return data[start:start + compressed]
+	if method == 8:
+		return zlib.decompress(data[start:start + compressed], -15)
+	raise zipfile.BadZipFile("unsupported compression method")
+
+def manifest(data, files):
+	# Read the attributes of the root <manifest> element from the binary AndroidManifest.xml
+	data = read(data, files["AndroidManifest.xml"])
+	# Anything that is not a binary xml document (plain text manifests, garbage) has nothing for us
+	if len(data) < 8 or struct.unpack_from("<H", data)[0] != 0x0003:
+		return None
+	pool, resources, offset = [], [], 8
+	while offset < len(data):
+		kind, header, size = struct.unpack_from("<HHI", data, offset)
+		# A chunk smaller than its own header would never let us move forward
+		if size < 8 or header > size:
+			return None
+		if kind == 0x0001:
+			pool = strings(data, offset)
+		elif kind == 0x0180:
+			resources = list(struct.unpack_from("<" + str((size - header) // 4) + "I", data, offset + header))
+		elif kind == 0x0102:
+			start, length, count = struct.unpack_from("<HHH", data, offset + header + 8)
+			attributes = {}
+			for index in range(count):
+				position = offset + header + start + index * length
+				name, raw, kind, value = struct.unpack_from("<4xIi3xBI", data, position)
+				# Attribute names may be stripped so rely on the resource identifier when present
+				name = "versionCode" if name < len(resources) and resources[name] == VERSIONCODE else pool[name]
+				attributes[name] = pool[value] if kind == 0x03 else pool[raw] if raw >= 0 else value
+			return {"package": attributes.get("package"), "versionCode": attributes.get("versionCode"), "split": attributes.get("split")}
+		offset += size
+	return None
+
+def prefixed(data, offset):
+	# Values inside the signing block are prefixed with their length as a 32 bits integer
+	length = struct.unpack_from("<I", data, offset)[0]
+	return data[offset + 4:offset + 4 + length], offset + 4 + length
+
+def signingblock(data):
+	# The APK Signing Block sits right before the central directory and ends with a magic
+	count, size, start = directory(data)
+	if start < 32:
+		return {}
+	length, magic = struct.unpack_from("<Q16s", data, start - 24)
+	if magic != b"APK Sig Block 42" or length + 8 > start:
+		return {}
+	block = data[start - length - 8:start - 24]
+	pairs, offset = {}, 8
+	while offset + 12 <= len(block):
+		length, identifier = struct.unpack_from("<QI", block, offset)
+		pairs[identifier] = block[offset + 12:offset + 8 + length]
+		offset += 8 + length
+	return pairs
+
+def der(data, offset):
+	# Return tag, start of contents and end of a DER element, end is None for indefinite lengths
+	tag, length = data[offset], data[offset + 1]
+	offset += 2
+	if length == 0x80:
+		return tag, offset, None
+	if length & 0x80:
+		size = length & 0x7f
+		length = int.from_bytes(data[offset:offset + size], "big")
+		offset += size
+	return tag, offset, offset + length
+
+def skip(data, offset):
+	tag, start, end = der(data, offset)
+	if end is not None:
+		return end
+	# BER indefinite lengths, as jarsigner writes them, end after the two zero bytes following the last child
+	while data[start:start + 2] != b"\0\0":
+		if start >= len(data):
+			raise ValueError("unterminated indefinite length")
+		start = skip(data, start)
+	return start + 2
+
+def pkcs7certificate(data):
+	# ContentInfo -> [0] SignedData -> version, digestAlgorithms, contentInfo, [0] certificates
+	tag, offset, end = der(data, 0)
+	offset = skip(data, offset)
+	tag, offset, end = der(data, offset)
+	tag, offset, end = der(data, offset)
+	for field in range(3):
+		offset = skip(data, offset)
+	tag, offset, end = der(data, offset)
+	if tag != 0xa0:
+		return None
+	return data[offset:skip(data, offset)]
+
+def certificate(data, files):
+	# Newer signature schemes keep the signer certificate on the signing block
+	pairs = signingblock(data)
+	for identifier in [identifier for identifier in SIGNATUREBLOCKS if identifier in pairs]:
+		try:
+			signers, offset = prefixed(pairs[identifier], 0)
+			signer, offset = prefixed(signers, 0)
+			signed, offset = prefixed(signer, 0)
+			digests, offset = prefixed(signed, 0)
+			certificates, offset = prefixed(signed, offset)
+			return SIGNATUREBLOCKS[identifier], prefixed(certificates, 0)[0]
+		except struct.error:
+			continue
+	# Fallback to v1 signed apks, which need a signature file and its PKCS#7 signature block under META-INF
+	for name in files:
+		match = re.match("(META-INF/[^/]+)\\.(RSA|DSA|EC)$", name)
+		if match and match.group(1) + ".SF" in files and "META-INF/MANIFEST.MF" in files:
+			try:
+				return "v1", pkcs7certificate(read(data, files[name]))
+			except (IndexError, TypeError, ValueError, zlib.error):
+				return "v1", None
+	return None, None
+
+def inspect(path):
+	# Tell whether an output came out of gradle already signed without starting apksigner nor extracting it
+	try:
+		data = archive(path)
+	except (OSError, ValueError):
+		return {"signed": False, "scheme": None, "digest": None}
+	try:
+		scheme, signer = certificate(data, dict(entries(data)))
+	except (zipfile.BadZipFile, IndexError, TypeError, ValueError, struct.error):
+		scheme, signer = None, None
+	finally:
+		data.close()
+	return {"signed": scheme is not None, "scheme": scheme, "digest": hashlib.sha256(signer).hexdigest() if signer else None}
+
+def signaturehash(certificate):
+	# Same value Android shows for each signature on "dumpsys package", which is java's Arrays.hashCode
+	value = 1
+	for byte in certificate:
+		value = (31 * value + (byte - 256 if byte > 127 else byte)) & 0xffffffff
+	return format(value, "x")
+
+def identity(path):
+	# Everything needed to tell if the apk is already installed on a device
+	try:
+		data = archive(path)
+	except (OSError, ValueError):
+		return None
+	try:
+		files = dict(entries(data))
+		info = manifest(data, files)
+		scheme, signer = certificate(data, files)
+	except (zipfile.BadZipFile, zlib.error, KeyError, IndexError, TypeError, ValueError, struct.error):
+		return None
+	finally:
+		data.close()
+	if not info or not info["package"] or info["versionCode"] is None:
+		return None
+	info["signature"] = signaturehash(signer) if signer else None
+	return info
@@ -0,0 +1,108 @@
+import sys
+import time
+import threading
+import contextlib
+from .statics import ansiescape
+
+class statusboard():
+	def __init__(self):
+		self.states = {}
+		self.started = {}
+		self.lock = threading.RLock()
+		# Output of each thread goes to the section it is working on instead of the console
+		self.local = threading.local()
+		self.console = None
+		self.drawn = 0
+		self.held = 0
+
+	def begin(self, names):
+		self.states = {name: "queued" for name in names}
+		self.started = {}
+		self.console = sys.stdout
+		# Only redraw in place on terminals that understand escape codes
+		self.live = self.console.isatty() and ansiescape["close"] != ""
+		sys.stdout = self
+
+	def end(self):
+		with self.lock:
+			self.erase()
+			sys.stdout = self.console
+
+	def update(self, name, state):
+		with self.lock:
+			self.states[name] = state
+			self.started[name] = time.time()
+			self.redraw()
+
+	@contextlib.contextmanager
+	def section(self, header = None):
+		# Everything printed by the project during the stage shows up as a single block once it is done
+		previous, self.local.buffer = getattr(self.local, "buffer", None), []
+		try:
+			yield
+		finally:
+			text, self.local.buffer = "".join(self.local.buffer), previous
+			if text:
+				self.emit("------------------------------------------\n" + header + "\n" + text if header else text)
+
+	@contextlib.contextmanager
+	def hold(self):
+		# Keep the table still while someone talks to the terminal directly, like password prompts
+		with self.lock:
+			self.erase()
+			self.held += 1
+		try:
+			yield
+		finally:
+			with self.lock:
+				self.held -= 1
+				self.redraw()
+
+	def emit(self, text):
+		with self.lock:
+			self.erase()
+			self.console.write(text)
+			self.console.flush()
+			self.redraw()
+
+	def write(self, text):
+		buffer = getattr(self.local, "buffer", None)
+		if buffer is not None:
+			buffer.append(text)
+		else:
+			self.emit(text)
+
+	def flush(self):
+		if getattr(self.local, "buffer", None) is None:
+			self.console.flush()
+
+	def isatty(self):
+		return self.console.isatty()
+
+	def erase(self):
+		if self.drawn:
+			# Move to the first line of the table and clear everything below
+			self.console.write("\u001b[" + str(self.drawn) + "F\u001b[J")
+			self.drawn = 0
+
+	def redraw(self):
+		if not self.live or self.held or self.console is None:
+			return
+		self.erase()
+		lines = self.table()
+		self.console.write("".join(line + "\n" for line in lines))
+		self.console.flush()
+		self.drawn = len(lines)
+
+	def table(self):
+		# Busy projects get a row each, the rest are only counted
+		busy = [name for name in self.states if self.states[name] not in ["queued", "done", "failed", "skipped"]]
+		counts = {state: list(self.states.values()).count(state) for state in ["queued", "done", "failed", "skipped"]}
+		lines = ["=========================================="]
+		for name in busy:
+			lines.append("     " + name + ": " + self.states[name] + " (" + str(int(time.time() - self.started[name])) + "s)")
+		lines.append("     " + str(len(busy)) + " working, " + str(counts["queued"]) + " queued, " + str(counts["done"]) + " done, " + str(counts["failed"]) + " failed, " + str(counts["skipped"]) + " skipped")
+		return lines
+
+# One table on the terminal with a row per project
+board = statusboard()
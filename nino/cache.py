@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from .config import running
+
+def filehash(path):
+	digest = hashlib.sha256()
+	with open(path, "rb") as file:
+		for chunk in iter(lambda: file.read(1048576), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+def place(source, target):
+	# Never write over the target in place because it may share its data with another link
+	if os.path.lexists(target):
+		os.remove(target)
+	try:
+		os.link(source, target)
+	except OSError:
+		# Hard links are not possible across filesystems so fallback to a copy
+		shutil.copy2(source, target)
+
+class buildcache():
+	def __init__(self):
+		self.root = None
+		self.entries = None
+		self.lock = threading.Lock()
+
+	def load(self):
+		# Read again whenever the run moves to another working directory, each one has its own cache
+		root = os.path.join(running["workdir"], ".nino-cache")
+		if self.entries is None or self.root != root:
+			self.root = root
+			try:
+				with open(os.path.join(self.root, "manifest.json"), "r") as file:
+					self.entries = json.load(file)
+			except (OSError, ValueError):
+				self.entries = {}
+		return self.entries
+
+	def blob(self, digest):
+		return os.path.join(self.root, "blobs", digest + ".apk")
+
+	def lookup(self, key):
+		# Forcing a real build means ignoring the stored artifacts, new ones will be stored anyway
+		if not key or running["nocache"]:
+			return None
+		with self.lock:
+			entry = self.load().get(key)
+			# Only builds that stored every single one of their outputs can be reused
+			if not entry or len(entry["artifacts"]) < entry["outputs"]:
+				return None
+			if not all(os.path.isfile(self.blob(artifact["blob"])) for artifact in entry["artifacts"]):
+				return None
+			entry["used"] = time.time()
+			return entry["artifacts"]
+
+	def expect(self, key, outputs):
+		# A new build replaces whatever was stored before for the same key
+		with self.lock:
+			self.load()[key] = {"outputs": outputs, "artifacts": [], "used": time.time()}
+
+	def store(self, key, artifact, path, digest = None):
+		digest = digest or filehash(path)
+		with self.lock:
+			entry = self.load().get(key)
+			if not entry:
+				return
+			# Identical outputs are stored only once
+			if not os.path.isfile(self.blob(digest)):
+				os.makedirs(os.path.join(self.root, "blobs"), exist_ok = True)
+				place(path, self.blob(digest))
+			entry["artifacts"].append(dict(artifact, blob = digest))
+
+	def save(self):
+		if self.entries is None:
+			return
+		# Keep only the most recently used builds, incomplete ones may still be completed by a retry run
+		entries = sorted(self.entries, key = lambda key: self.entries[key]["used"], reverse = True)
+		self.entries = {key: self.entries[key] for key in entries[:running["cachesize"]]}
+		# Forget about the outputs no build references anymore
+		referenced = set(artifact["blob"] + ".apk" for entry in self.entries.values() for artifact in entry["artifacts"])
+		if os.path.isdir(os.path.join(self.root, "blobs")):
+			for name in os.listdir(os.path.join(self.root, "blobs")):
+				if name not in referenced:
+					os.remove(os.path.join(self.root, "blobs", name))
+		os.makedirs(self.root, exist_ok = True)
+		with open(os.path.join(self.root, "manifest.json"), "w") as file:
+			json.dump(self.entries, file, indent = '\t')
+
+# Concurrent builds store their outputs through the same manifest, guarded by its lock
+cache = buildcache()
@@ -1,125 +1,132 @@
-import sys
 import os
 import json
 import copy
-import getpass
-import subprocess
 import argparse
 import toml
-from .statics import projects, defconfig
+from .statics import defconfig
 
-running = {"projects": {"default": {}}, "keystores": {}, "devices": {}, "retry": False, "force": []}
+# Settings shared by every module during a run, filled in place by setup() so imports never go stale
+running = {}
+# Projects set for retry on a previous run
+retryconfig = {}
+# Retryable config that will be dumped onto .nino-last at the end
+failed = {}
+# Every project folder found on the working directory
+projects = []
 
-# Register each argument that will be read from command line
-parser = argparse.ArgumentParser()
-parser.add_argument('-f', '--force', action="append", help="Force build of a project even without changes")
-parser.add_argument('-r', '--retry', action='store_true', help="Retry failed tasks from previous run")
-parser.add_argument('--version', action='version', version='%(prog)s 1.1')
-args = vars(parser.parse_args())
-# We skip any argument that comes as None because that means it was not passed
-for opt in [arg for arg in args if args[arg]]:
-	running[opt] = args[opt]
+# Raised instead of exiting so embedders can handle it, main() turns it into the exit status
+class ninoerror(Exception):
+	pass
 
-# The expected configuration file name varies from .nino-last (for retry mode) to nino.toml (normal mode)
-filename = ".nino-last" if running["retry"] else "nino.toml"
-# Retrieve entire configuration from local configuration file
-try:
-	with open(filename, "r") as file:
-		content = json.load(file) if running["retry"] else toml.loads(file.read())
-		running.update(content)
-# No config file means we take all the defaults from defconfig. Spoiler: Nino does nothing
-except:
-	print("Failed to load config from file " + filename + ". Halting")
-	sys.exit(1)
+defaults = {"projects": {"default": {}}, "keystores": {}, "devices": {}, "retry": False, "force": [], "syncjobs": 4, "buildjobs": 1, "daemonidle": 30, "daemonheap": False, "nocache": False, "cachesize": 100, "deployjobs": 4, "rescan": False, "dedup": True, "probe": True, "loglines": 20, "logruns": 10, "logsize": 50, "releasekeep": 5, "releasesize": 0, "gradlecache": False}
 
-# Setup a set-for-retry list of projects so we skip those during a normal running
-retryconfig = {}
-if not running["retry"]:
+def arguments(argv = None):
+	# Register each argument that will be read from command line
+	parser = argparse.ArgumentParser(prog="nino")
+	parser.add_argument('-f', '--force', action="append", help="Force build of a project even without changes")
+	parser.add_argument('-r', '--retry', action='store_true', help="Retry failed tasks from previous run")
+	parser.add_argument('-j', '--syncjobs', type=int, help="Amount of remotes fetched at the same time during sync")
+	parser.add_argument('-b', '--buildjobs', type=int, help="Amount of projects built at the same time")
+	parser.add_argument('--no-cache', dest="nocache", action='store_true', help="Build again even if an identical build was stored")
+	parser.add_argument('--report', action='store_true', help="Show how long each project took on previous runs and exit")
+	parser.add_argument('--daemon', action='store_true', help="Keep running, polling every project on its own interval")
+	parser.add_argument('--control', nargs='+', metavar="COMMAND", help="Send force, retry, poll, status or stop (followed by project names) to a running daemon")
+	parser.add_argument('--gradle-cache', dest="gradlecacheview", action='store_true', help="Show how much space the shared gradle cache takes and exit")
+	parser.add_argument('--evict-gradle-cache', dest="evict", type=int, metavar="DAYS", help="Remove build cache entries unused for DAYS days (0 also removes dependencies) and exit")
+	parser.add_argument('--releases', action='store_true', help="Show the releases kept for every output and exit")
+	parser.add_argument('--plan', action='store_true', help="Show the order projects would be handled in and the predicted finish time and exit")
+	parser.add_argument('--version', action='version', version='%(prog)s 1.1')
+	args = vars(parser.parse_args(argv))
+	# We skip any argument that comes as None or False because that means it was not passed, zero is a valid amount
+	return {arg: args[arg] for arg in args if args[arg] is not None and args[arg] is not False}
+
+def load(options = {}, path = None):
+	# The expected configuration file name varies from .nino-last (for retry mode) to nino.toml (normal mode)
+	filename = os.path.join(path or os.getcwd(), ".nino-last" if options.get("retry", False) else "nino.toml")
+	# Retrieve entire configuration from local configuration file
 	try:
-		with open(".nino-last", "r") as file:
-			retryconfig = json.load(file)["projects"]
+		with open(filename, "r") as file:
+			return json.load(file) if options.get("retry", False) else toml.loads(file.read())
+	# No config file means we take all the defaults from defconfig. Spoiler: Nino does nothing
 	except:
-		pass
+		raise ninoerror("Failed to load config from file " + filename + ". Halting")
 
-# Add missing fields in default project config using values from defconfig
-for entry in defconfig:
-	if entry not in running["projects"]["default"]:
-		running["projects"]["default"][entry] = defconfig[entry]
+def setup(config, options = {}, path = None):
+	# Start from a clean slate so consecutive runs on the same process do not leak settings
+	running.clear()
+	running.update(copy.deepcopy(defaults))
+	running.update(copy.deepcopy(config))
+	# Command line options have the last word over the configuration file
+	running.update(options)
+	running["workdir"] = os.path.abspath(path or os.getcwd())
 
-# Retryable config that will be dumped onto .nino-last at the end, must retain keystore (before enables and promps) and device list
-failed = {
-	"projects": {"default" : {}},
-	"keystores": copy.deepcopy(running["keystores"]),
-	"devices": copy.deepcopy(running["devices"])
-}
+	# Every folder but the releases one and hidden ones (nino state) is a project
+	projects[:] = sorted(name for name in os.listdir(running["workdir"]) if os.path.isdir(os.path.join(running["workdir"], name)) and name != "NINO-RELEASES" and not name.startswith("."))
 
-defconfig = running["projects"]["default"]
-keystores = running["keystores"]
-wentwrong = False
-for project in projects:
-	# Tasks and project are referenced a couple of times so store them temporarily
-	pconfig = running["projects"].get(project, {})
-	tasks = pconfig.get("tasks", defconfig["tasks"])
-	for task in tasks:
-		# If task has build enabled we go on, else fallback to project config, and then again to defconfig
-		if tasks[task].get("build", pconfig.get("build", defconfig["build"])):
-			# Get the reference names for store and alias from project config
-			store = tasks[task].get("keystore", pconfig.get("keystore", defconfig["keystore"]))
-			alias = tasks[task].get("keyalias", pconfig.get("keyalias", defconfig["keyalias"]))
-			if not store or not alias:
-				print(project + ": " + task + ": build enabled but keystore/keyalias are undefined. Please review your configuration file.")
-				wentwrong = True
-				continue
-			try:
-				# Confirm that both store and alias have entries on configuration file
-				keystores[store]["used"] = True
-				keystores[store]["aliases"][alias]["used"] = True
-			except KeyError:
-				print(project + ": " + store + "/" + alias + " is not a valid keystore/keyalias combination. Please review your configuration file.")
-				wentwrong = True
-				continue
-			else:
-				path = keystores[store].get("path", ".")
-				# Make sure the absolute filesystem path exists
-				if os.path.isfile(path):
-					keystores[store]["path"] = os.path.abspath(path)
-				else:
-					print(project + ": " + task + ": Path " + os.path.abspath(path) + " for keystore " + store + " does not exist. Please review your configuration file.")
-					wentwrong = True
-# We do not forcefully end nino until all related errors were printed
-if wentwrong:
-	sys.exit(1)
+	# Setup a set-for-retry list of projects so we skip those during a normal running
+	retryconfig.clear()
+	if not running["retry"]:
+		try:
+			with open(os.path.join(running["workdir"], ".nino-last"), "r") as file:
+				retryconfig.update(json.load(file)["projects"])
+		except:
+			pass
 
-# Only loop through enabled keystores, as we are guaranteed to have at least one enabled keyalias
-for store in [store for store in keystores if keystores[store].get("used", False)]:
-	try:
-		# If password was already read from config file we skip prompt
-		keystores[store]["password"]
-	except KeyError:
-		keystores[store]["password"] = getpass.getpass("Enter password of keystore '" + store + "' (" + keystores[store]["path"] + "): ")
-	# Only loop through enabled aliases
-	for alias in [alias for alias in keystores[store]["aliases"] if keystores[store]["aliases"][alias].get("used", False)]:
-		# Test provided password by listing keystore to see if the alias actually exists
-		listing = subprocess.Popen(["keytool", "-list", "-keystore", keystores[store]["path"], "-alias", keystores[store]["aliases"][alias]["name"]], stdout = subprocess.DEVNULL, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-		listing.communicate(input=keystores[store]["password"].encode())
-		if listing.returncode != 0:
-			print("Keystore password is incorrect or alias '" + alias + "' (" + keystores[store]["aliases"][alias]["name"] + ") does not exist on keystore '" + store +"' (" + keystores[store]["path"] + ")")
-			sys.exit(1)
-		else:
-			# Ask for the key password
-			try:
-				# If password was already read from config file we skip prompt
-				keystores[store]["aliases"][alias]["password"]
-			except KeyError:
-				keystores[store]["aliases"][alias]["password"] = getpass.getpass("	 Enter password for key '" + alias + "' (" + keystores[store]["aliases"][alias]["name"] + ") of keystore '"+ store + "' (" + keystores[store]["path"] + "): ")
-			# Attempt to export to a temporal keystore to test the alias password
-			testkey = subprocess.Popen(["keytool", "-importkeystore", "-srckeystore", keystores[store]["path"], "-destkeystore", "tmpstore", "-deststorepass", "tmpstore", "-srcalias", keystores[store]["aliases"][alias]["name"]],  stdout = subprocess.DEVNULL, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-			# Generate the input using the two passwords and feed it to the subprocess
-			secrets = keystores[store]["password"] + "\n" + keystores[store]["aliases"][alias]["password"]
-			testkey.communicate(input=secrets.encode())
-			if testkey.returncode == 0:
-				# Everything was fine, delete the temporal keystore
-				os.remove("tmpstore")
-			else:
-				print("Provided password for key '" + alias + "' (" + keystores[store]["aliases"][alias]["name"] + ") of keystore '" + store +"' (" + keystores[store]["path"] + ") is incorrect")
-				sys.exit(1)
+	# Add missing fields in default project config using values from defconfig
+	for entry in defconfig:
+		if entry not in running["projects"]["default"]:
+			running["projects"]["default"][entry] = defconfig[entry]
+
+	# Must retain keystores as written (before enables and prompts) and device list
+	failed.clear()
+	failed.update({
+		"projects": {"default" : {}},
+		"keystores": copy.deepcopy(running["keystores"]),
+		"devices": copy.deepcopy(running["devices"])
+	})
+
+	validate()
+
+def validate():
+	# Only the structure is checked here, passwords are tested by the keyring once something needs signing
+	default = running["projects"]["default"]
+	keystores = running["keystores"]
+	wentwrong = False
+	for project in projects:
+		# Tasks and project are referenced a couple of times so store them temporarily
+		pconfig = running["projects"].get(project, {})
+		tasks = pconfig.get("tasks", default["tasks"])
+		# Shallow and partial repositories are missing objects, other projects could never borrow them safely
+		if pconfig.get("shared", default["shared"]) and (pconfig.get("depth", default["depth"]) or pconfig.get("partial", default["partial"])):
+			print(project + ": shared can not be combined with depth nor partial. Please review your configuration file.")
+			wentwrong = True
+		for task in tasks:
+			# If task has build enabled we go on, else fallback to project config, and then again to defconfig
+			if tasks[task].get("build", pconfig.get("build", default["build"])):
+				# Get the reference names for store and alias from project config
+				store = tasks[task].get("keystore", pconfig.get("keystore", default["keystore"]))
+				alias = tasks[task].get("keyalias", pconfig.get("keyalias", default["keyalias"]))
+				if not store or not alias:
+					print(project + ": " + task + ": build enabled but keystore/keyalias are undefined. Please review your configuration file.")
+					wentwrong = True
+					continue
+				try:
+					# Confirm that both store and alias have entries on configuration file
+					keystores[store]["used"] = True
+					keystores[store]["aliases"][alias]["used"] = True
+				except KeyError:
+					print(project + ": " + store + "/" + alias + " is not a valid keystore/keyalias combination. Please review your configuration file.")
+					wentwrong = True
+					continue
+				else:
+					# Relative paths are taken from the working directory, not from wherever we were called
+					path = os.path.join(running["workdir"], keystores[store].get("path", "."))
+					# Make sure the absolute filesystem path exists
+					if os.path.isfile(path):
+						keystores[store]["path"] = os.path.abspath(path)
+					else:
+						print(project + ": " + task + ": Path " + os.path.abspath(path) + " for keystore " + store + " does not exist. Please review your configuration file.")
+						wentwrong = True
+	# We do not forcefully end nino until all related errors were printed
+	if wentwrong:
+		raise ninoerror("Invalid configuration, halting")
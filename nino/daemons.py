@@ -0,0 +1,84 @@
+import os
+import re
+import time
+import threading
+import subprocess
+from .config import running
+
+def heapsize(builddir):
+	# Estimate the heap of a daemon from the jvmargs of the project, gradle defaults to 512 MiB
+	try:
+		with open(os.path.join(builddir, "gradle.properties"), "r") as file:
+			match = re.search("org\\.gradle\\.jvmargs\\s*=.*-Xmx(\\d+)([kKmMgG]?)", file.read())
+	except OSError:
+		match = None
+	if not match:
+		return 512
+	amount, unit = int(match[1]), match[2].lower()
+	if unit == "k":
+		return amount // 1024
+	elif unit == "m":
+		return amount
+	elif unit == "g":
+		return amount * 1024
+	return amount // 1048576
+
+def distribution(builddir):
+	# Daemons are only shared between builds using the same gradle distribution
+	try:
+		with open(os.path.join(builddir, "gradle", "wrapper", "gradle-wrapper.properties"), "r") as file:
+			match = re.search("distributionUrl\\s*=\\s*(.*)", file.read())
+	except OSError:
+		match = None
+	return match[1].strip() if match else "system"
+
+class daemonpool():
+	def __init__(self):
+		# Each JAVA_HOME groups the daemons of every gradle distribution started with it
+		self.groups = {}
+		self.lock = threading.Lock()
+
+	def acquire(self, javahome, builddir, command, env):
+		key = javahome or "default"
+		with self.lock:
+			# Get rid of groups nobody used for longer than the idle timeout
+			self.evict(time.time() - running["daemonidle"] * 60)
+			group = self.groups.setdefault(key, {"daemons": {}, "active": 0, "last": time.time()})
+			release = distribution(builddir)
+			if release not in group["daemons"]:
+				# Remember how to reach the daemon so it can be stopped later on
+				group["daemons"][release] = {"command": command, "cwd": builddir, "env": env, "heap": heapsize(builddir)}
+				# Make room for the new daemon by stopping the least recently used idle groups
+				if running["daemonheap"]:
+					idle = sorted([name for name in self.groups if name != key and self.groups[name]["active"] == 0], key = lambda name: self.groups[name]["last"])
+					while idle and self.heap() > running["daemonheap"]:
+						self.stop(idle.pop(0))
+			group["active"] += 1
+			group["last"] = time.time()
+		# Gradle also shuts down on its own any daemon left behind if nino dies
+		return ["--daemon", "-Dorg.gradle.daemon.idletimeout=" + str(running["daemonidle"] * 60000)]
+
+	def release(self, javahome):
+		with self.lock:
+			group = self.groups[javahome or "default"]
+			group["active"] -= 1
+			group["last"] = time.time()
+
+	def heap(self):
+		return sum(daemon["heap"] for group in self.groups.values() for daemon in group["daemons"].values())
+
+	def evict(self, threshold):
+		for key in [key for key in self.groups if self.groups[key]["active"] == 0 and self.groups[key]["last"] < threshold]:
+			self.stop(key)
+
+	def stop(self, key):
+		for daemon in self.groups.pop(key)["daemons"].values():
+			subprocess.call(daemon["command"] + ["--stop"], cwd = daemon["cwd"], env = daemon["env"], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+	def stopall(self):
+		with self.lock:
+			for key in list(self.groups):
+				self.stop(key)
+
+# Builds of different projects borrow warm daemons from the same groups
+pool = daemonpool()
@@ -0,0 +1,125 @@
+import re
+import os
+import json
+import threading
+import subprocess
+from .config import running
+from .metrics import run
+
+def packages(dump):
+	# Extract version and signatures of each package from "dumpsys package packages"
+	installed, package = {}, None
+	for line in dump.splitlines():
+		match = re.match("\\s*Package \\[([^\\]]+)\\]", line)
+		if match:
+			# Packages may show up again on later sections, the first time is the installed one
+			package = None if match[1] in installed else match[1]
+			if package:
+				installed[package] = {"versionCode": None, "signatures": []}
+			continue
+		if not package:
+			continue
+		match = re.search("versionCode=(\\d+)", line)
+		if match and installed[package]["versionCode"] is None:
+			installed[package]["versionCode"] = int(match[1])
+		match = re.search("signatures=PackageSignatures\\{[^\\[]*\\[([0-9a-f, ]*)\\]", line)
+		if match:
+			installed[package]["signatures"] = [signature.strip() for signature in match[1].split(",") if signature.strip()]
+	return installed
+
+class census():
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		# Serials attached to adb along with their properties, only known after the first scan
+		self.devices = None
+		# Packages installed on each device, asked once per run, and the record of previous runs
+		self.packages = {}
+		self.state, self.workdir = None, None
+		# Features advertised by each device and whether the local adb supports streaming installs
+		self.features = {}
+		self.streams = None
+
+	def scan(self):
+		devices = {}
+		try:
+			listing = run(["adb", "devices", "-l"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = 30)
+		except (OSError, subprocess.TimeoutExpired):
+			return devices
+		# Skip the header, every other line is "serial state key:value..."
+		for line in listing.stdout.decode('ascii', 'ignore').splitlines()[1:]:
+			fields = line.split()
+			if len(fields) < 2:
+				continue
+			devices[fields[0]] = {"state": fields[1]}
+			devices[fields[0]].update(dict(field.split(":", 1) for field in fields[2:] if ":" in field))
+		return devices
+
+	def online(self, refresh = False):
+		# A single scan serves the whole run unless asked to look again
+		with self.lock:
+			if self.devices is None or refresh:
+				self.devices = self.scan()
+			return [serial for serial in self.devices if self.devices[serial]["state"] == "device"]
+
+	def streaming(self, serial):
+		with self.lock:
+			if self.streams is None:
+				try:
+					usage = run(["adb", "help"], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, timeout = 30)
+					self.streams = b"--streaming" in usage.stdout
+				except (OSError, subprocess.TimeoutExpired):
+					self.streams = False
+		if serial not in self.features:
+			try:
+				listing = run(["adb", "-s", serial, "features"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = 30)
+				self.features[serial] = listing.stdout.decode('ascii', 'ignore').split()
+			except (OSError, subprocess.TimeoutExpired):
+				self.features[serial] = []
+		# Streaming needs the cmd service of the package manager on the device
+		return self.streams and "cmd" in self.features[serial]
+
+	def load(self):
+		# What previous runs installed is recorded next to the projects, so another working directory has its own
+		if self.state is None or self.workdir != running["workdir"]:
+			self.workdir = running["workdir"]
+			try:
+				with open(os.path.join(running["workdir"], ".nino-devices"), "r") as file:
+					self.state = json.load(file)
+			except (OSError, ValueError):
+				self.state = {}
+		return self.state
+
+	def inventory(self, serial):
+		if serial not in self.packages:
+			try:
+				dump = run(["adb", "-s", serial, "shell", "dumpsys", "package", "packages"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = 120)
+				installed = packages(dump.stdout.decode('utf-8', 'ignore')) if dump.returncode == 0 else {}
+			except (OSError, subprocess.TimeoutExpired):
+				installed = {}
+			with self.lock:
+				# When the device does not tell us we trust what we installed on previous runs
+				self.packages[serial] = installed if installed else dict(self.load().get(serial, {}))
+		return self.packages[serial]
+
+	def current(self, serial, info):
+		# Whether the device already has this exact build of the package, signed with the same certificate
+		installed = self.inventory(serial).get(info["package"])
+		return bool(installed and info["signature"] and installed["versionCode"] == info["versionCode"] and info["signature"] in installed["signatures"])
+
+	def record(self, serial, info):
+		with self.lock:
+			entry = {"versionCode": info["versionCode"], "signatures": [info["signature"]] if info["signature"] else []}
+			self.packages.setdefault(serial, {})[info["package"]] = entry
+			self.load().setdefault(serial, {})[info["package"]] = entry
+
+	def save(self):
+		with self.lock:
+			if self.state is not None:
+				with open(os.path.join(running["workdir"], ".nino-devices"), "w") as file:
+					json.dump(self.state, file, indent = '\t')
+
+# Attached devices and what they have installed, looked up once for every project deploying to them
+devices = census()
@@ -1,17 +1,23 @@
 import os
+import hashlib
+import functools
 import subprocess
+from . import gitrefs
 from .statics import execprefix, fetchmethods
+from .metrics import call, run, Popen
 
 class fetchmethod():
-	def __init__(self):
+	def __init__(self, path):
 		self.type = None
-		localdir = os.listdir()
+		localdir = os.listdir(path)
 		# Detect the valid fetching method for the project run
 		for method in fetchmethods:
 			if method in localdir:
 				self.type = fetchmethods[method]
-				for operation in ["lastdate", "changes", "fetch", "updated", "newtag", "merge", "tagswap", "restore"]:
-					setattr(self, operation, getattr(eval(self.type), operation))
+				for operation in ["lastdate", "changes", "revision", "probe", "fetch", "updated", "newtag", "merge", "tagswap", "restore", "target", "checkout", "series"]:
+					# Bind the project path so operations can run no matter the current working directory, some are only known by some methods
+					if hasattr(eval(self.type), operation):
+						setattr(self, operation, functools.partial(getattr(eval(self.type), operation), path))
 				break
 		# We need to outright store the lastdate because it will be used on project presentation
 		if not self.type:
@@ -20,68 +26,140 @@ class fetchmethod():
 		self.lastdate = self.lastdate()
 
 class custom():
-	def lastdate():
-		return subprocess.Popen([execprefix + "nino-sync", "lastdate"], stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
-	def changes():
-		modified = subprocess.call([execprefix + "nino-sync", "changes"])
+	def lastdate(path):
+		return Popen([execprefix + "nino-sync", "lastdate"], cwd = path, stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
+	def changes(path):
+		modified = call([execprefix + "nino-sync", "changes"], cwd = path)
 		return "Diff restore managed by custom script".encode() if modified == 0 else "".encode()
-	def fetch(logfile):
-		pull = subprocess.call([execprefix + "nino-sync", "fetch"], stdout = logfile, stderr = subprocess.STDOUT)
+	def revision(path):
+		# Optional operation, the script must identify the exact state of the sources including local changes
+		try:
+			state = run([execprefix + "nino-sync", "revision"], cwd = path, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+		except OSError:
+			return None
+		return state.stdout.decode('ascii', 'ignore').strip() if state.returncode == 0 else None
+	def probe(path, followtags, logfile):
+		# Optional operation, the script prints "unchanged" if the remote has nothing new since the last fetch
+		try:
+			state = run([execprefix + "nino-sync", "probe"], cwd = path, stdout = subprocess.PIPE, stderr = logfile)
+		except OSError:
+			return True
+		return state.returncode != 0 or state.stdout.decode('ascii', 'ignore').strip().lower() != "unchanged"
+	def fetch(path, logfile, depth = False):
+		# The script decides by itself how much history to keep
+		pull = call([execprefix + "nino-sync", "fetch"], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
 		return True if pull == 0 else False
-	def updated():
-		changed = subprocess.call([execprefix + "nino-sync", "updated"])
+	def updated(path):
+		changed = call([execprefix + "nino-sync", "updated"], cwd = path)
 		return True if changed == 0 else False
-	def merge(logfile):
-		merged = subprocess.call([execprefix + "nino-sync", "merge"], stdout = logfile, stderr = subprocess.STDOUT)
+	def merge(path, logfile):
+		merged = call([execprefix + "nino-sync", "merge"], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
 		return True if merged == 0 else False
-	def restore(diff, logfile):
-		apply = subprocess.call([execprefix + "nino-sync", "restore"], stdout = logfile, stderr = subprocess.STDOUT)
+	def restore(path, diff, logfile):
+		apply = call([execprefix + "nino-sync", "restore"], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
 		return True if apply == 0 else False
 
 class git():
-	def lastdate():
-		return subprocess.Popen(["git", "log", "-n", "1", "--format=%cr"], stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
-	def changes():
-		return subprocess.Popen(["git", "diff"], stdout = subprocess.PIPE).communicate()[0]
-	def fetch(logfile):
-		pull = subprocess.call(["git", "fetch"], stdout = logfile, stderr = subprocess.STDOUT)
+	def lastdate(path):
+		date = gitrefs.commitdate(path)
+		if date is not None:
+			return gitrefs.relative(date)
+		# HEAD may point to a commit no ref knows about
+		return Popen(["git", "log", "-n", "1", "--format=%cr"], cwd = path, stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
+	def changes(path):
+		return Popen(["git", "diff"], cwd = path, stdout = subprocess.PIPE).communicate()[0]
+	def revision(path):
+		# Commit checked out plus a digest of the uncommitted changes on top of it
+		branch, head = gitrefs.head(path)
+		if not head:
+			return None
+		diff = run(["git", "diff", "HEAD"], cwd = path, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+		return head + "-" + hashlib.sha256(diff.stdout).hexdigest()
+	def probe(path, followtags, logfile):
+		# Compare what the remote advertises with the refs we got on the last fetch, which act as the cached copy
+		branch, local = gitrefs.head(path)
+		remote, merge = gitrefs.tracking(path, branch or "HEAD")
+		command = ["git", "ls-remote", "--tags", "--refs", remote] if followtags else ["git", "ls-remote", remote, merge]
+		listing = run(command, cwd = path, stdout = subprocess.PIPE, stderr = logfile)
+		advertised = [line.split("\t") for line in listing.stdout.decode('utf-8', 'ignore').splitlines() if "\t" in line]
+		# Anything unexpected means we better do a full fetch
+		if listing.returncode != 0 or (not advertised and not followtags):
+			return True
+		if followtags:
+			known = gitrefs.tags(path)
+			return any(known.get(ref[10:]) != sha for sha, ref in advertised)
+		return advertised[0][0] != gitrefs.readref(path, gitrefs.upstream(path, branch or "HEAD"))
+	def fetch(path, logfile, depth = False):
+		# Shallow projects only keep the given amount of commits from the tip of each branch
+		pull = call(["git", "fetch"] + (["--depth=" + str(depth)] if depth else []), cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+		gitrefs.forget(path)
 		return True if pull == 0 else False
-	def updated():
-		# Branch and remote name on current local repository
-		branch = subprocess.Popen(["git", "rev-parse", "--abbrev-ref", "--symbolic-full-name", "HEAD"], stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
-		remote = subprocess.Popen(["git", "remote"], stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
+	def updated(path):
+		# Branch on current local repository and commits of both it and the remote one, read straight from the refs
+		branch, local = gitrefs.head(path)
+		# A detached HEAD is compared with the default branch of the remote
+		remote = gitrefs.readref(path, gitrefs.upstream(path, branch or "HEAD"))
+		if not remote or remote == local:
+			return False, "0"
 		# Amount of commits the remote is ahead of the local copy
-		commitcount = subprocess.Popen(["git", "rev-list", branch + ".." + remote + "/" + branch, "--count"], stdout = subprocess.PIPE).communicate()[0].decode('ascii')
+		commitcount = Popen(["git", "rev-list", "--count", local + ".." + remote], cwd = path, stdout = subprocess.PIPE).communicate()[0].decode('ascii').strip()
 		# If the count is bigger than zero it means we can merge new stuff
-		return True if int(commitcount) > 0 else False, commitcount
-	def newtag():
-		# Current tag on the repo
-		tag_old = subprocess.Popen(["git", "describe", "--exact-match", "--tags"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).communicate()[0].decode('ascii', 'ignore').strip()
+		return True if commitcount and int(commitcount) > 0 else False, commitcount
+	def newtag(path, pattern = False):
+		branch, local = gitrefs.head(path)
+		tags = [ref for ref in gitrefs.snapshot(path) if ref["ref"].startswith("refs/tags/")]
+		# Current tag on the repo, the newest one pointing to HEAD
+		tag_old = next((tag["ref"][10:] for tag in tags if tag["commit"] == local), "")
 		tag_new = tag_old
-		# Get the most recent commit associated with a tag (exluding betas and alphas)
-		tags = subprocess.Popen(["git", "tag", "--sort", "-creatordate"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).communicate()[0].decode('ascii', 'ignore')
-		for tag in tags.split("\n"):
-			# Some invalid tags contain this strings
-			NORELEASETAGS = ["alpha", "beta", "rc", "-"]
-			if not any(x in tag for x in NORELEASETAGS):
-				tag_new = tag
+		# Get the most recent tag considered a release (exluding betas and alphas unless told otherwise)
+		for tag in tags:
+			if gitrefs.release(tag["ref"][10:], pattern):
+				tag_new = tag["ref"][10:]
 				break
 		# If tag_old and tag_new are different report as updated
 		return True if tag_old != tag_new else False, tag_new
-	def merge(logfile):
+	def merge(path, logfile):
 		# Always clean the working dir to avoid merging issues
-		subprocess.call(["git", "checkout", "."], stdout = logfile, stderr = subprocess.STDOUT)
+		call(["git", "checkout", "."], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
 		# Try to merge the changes
-		update = subprocess.call(["git", "merge"], stdout = logfile, stderr = subprocess.STDOUT)
+		update = call(["git", "merge"], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+		gitrefs.forget(path)
 		return True if update == 0 else False
-	def tagswap(logfile, tag_new):
+	def tagswap(path, logfile, tag_new):
 		# Always clean the working dir to avoid merging issues
-		subprocess.call(["git", "checkout", "."], stdout = logfile, stderr = subprocess.STDOUT)
+		call(["git", "checkout", "."], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
 		# Try to merge the changes
-		update = subprocess.call(["git", "checkout", tag_new], stdout = logfile, stderr = subprocess.STDOUT)
+		update = call(["git", "checkout", tag_new], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+		gitrefs.forget(path)
 		return True if update == 0 else False
-	def restore(diff, logfile):
+	def restore(path, diff, logfile):
 		print("\n" + diff.decode() + "\n", file = logfile, flush = True)
-		apply = subprocess.Popen(["git", "apply"], stdout = logfile, stderr = subprocess.STDOUT, stdin=subprocess.PIPE)
+		apply = Popen(["git", "apply"], cwd = path, stdout = logfile, stderr = subprocess.STDOUT, stdin=subprocess.PIPE)
 		apply.communicate(input = diff)
 		return True if apply.returncode == 0 else False
+	def target(path, followtags, pattern = False):
+		# Commit that would be checked out by merging: the newest release tag or the upstream of the current branch
+		if followtags:
+			updated, tag = git.newtag(path, pattern)
+			return next((ref["commit"] for ref in gitrefs.snapshot(path) if ref["ref"] == "refs/tags/" + tag), None)
+		branch, local = gitrefs.head(path)
+		return gitrefs.readref(path, gitrefs.upstream(path, branch or "HEAD"))
+	def checkout(path, folder, commit, logfile):
+		# Reuse the worktree if it is still around so gradle finds the outputs of its previous build
+		if os.path.isfile(os.path.join(folder, ".git")):
+			update = call(["git", "checkout", "--force", "--detach", commit], cwd = folder, stdout = logfile, stderr = subprocess.STDOUT)
+			# Drop files left by patches of the previous revision, ignored ones like build outputs stay
+			if update == 0:
+				update = call(["git", "clean", "-fd"], cwd = folder, stdout = logfile, stderr = subprocess.STDOUT)
+		else:
+			update = call(["git", "worktree", "add", "--force", "--detach", folder, commit], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+		gitrefs.forget(folder)
+		return True if update == 0 else False
+	def series(path, folder, patches, logfile):
+		# Apply every patch in order, stopping on the first one that does not apply
+		for patch in patches:
+			print("Applying " + patch, file = logfile, flush = True)
+			apply = call(["git", "apply", "--whitespace=nowarn", patch], cwd = folder, stdout = logfile, stderr = subprocess.STDOUT)
+			if apply != 0:
+				return os.path.basename(patch)
+		return None
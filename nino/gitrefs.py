@@ -0,0 +1,173 @@
+import os
+import re
+import time
+import threading
+import subprocess
+from .metrics import run
+
+# Fields asked to git for every ref, peeled values belong to the commit an annotated tag points to
+FIELDS = ["refname", "objectname", "*objectname", "committerdate:unix", "*committerdate:unix"]
+# Some invalid tags contain this strings
+NORELEASETAGS = ["alpha", "beta", "rc", "-"]
+
+# Refs of each project as listed by git, dropped whenever they may have changed
+snapshots = {}
+lock = threading.Lock()
+
+def gitdir(path):
+	dotgit = os.path.join(path, ".git")
+	# Worktrees and submodules have a file pointing to the real git directory
+	if os.path.isfile(dotgit):
+		with open(dotgit, "r") as file:
+			content = file.read().strip()
+		if content.startswith("gitdir: "):
+			return os.path.normpath(os.path.join(path, content[8:]))
+	return dotgit
+
+def commondir(git):
+	# Refs and config are shared with the main repository when the git directory belongs to a worktree
+	try:
+		with open(os.path.join(git, "commondir"), "r") as file:
+			return os.path.normpath(os.path.join(git, file.read().strip()))
+	except OSError:
+		return git
+
+def packedrefs(common):
+	refs = {}
+	try:
+		with open(os.path.join(common, "packed-refs"), "r") as file:
+			for line in file:
+				# Skip the header and the peeled lines following annotated tags
+				if line.startswith("#") or line.startswith("^"):
+					continue
+				fields = line.split()
+				if len(fields) == 2:
+					refs[fields[1]] = fields[0]
+	except OSError:
+		pass
+	return refs
+
+def readref(path, ref, depth = 0):
+	git = gitdir(path)
+	common = commondir(git)
+	# HEAD lives on the git directory of each worktree, everything under refs/ on the common one
+	try:
+		with open(os.path.join(common if ref.startswith("refs/") else git, ref), "r") as file:
+			content = file.read().strip()
+	except OSError:
+		content = packedrefs(common).get(ref)
+	# Follow symbolic refs
+	if content and content.startswith("ref: ") and depth < 5:
+		return readref(path, content[5:], depth + 1)
+	return content
+
+def head(path):
+	# Branch checked out, if any, and the commit HEAD points to
+	try:
+		with open(os.path.join(gitdir(path), "HEAD"), "r") as file:
+			content = file.read().strip()
+	except OSError:
+		return None, None
+	branch = content[16:] if content.startswith("ref: refs/heads/") else None
+	return branch, readref(path, "HEAD")
+
+def config(path):
+	# Minimal reader of the sections and keys of the repository configuration
+	sections, section = {}, None
+	try:
+		with open(os.path.join(commondir(gitdir(path)), "config"), "r") as file:
+			for line in file:
+				match = re.match("\\s*\\[\\s*([^\\s\\]\"]+)(?:\\s+\"(.*)\")?\\s*\\]", line)
+				if match:
+					section = (match[1].lower(), match[2])
+					sections.setdefault(section, {})
+					continue
+				match = re.match("\\s*([A-Za-z0-9-]+)\\s*=\\s*(.*?)\\s*$", line)
+				if match and section:
+					sections[section][match[1].lower()] = match[2]
+	except OSError:
+		pass
+	return sections
+
+def tracking(path, branch):
+	sections = config(path)
+	settings = sections.get(("branch", branch), {})
+	# Without tracking configuration use the first remote and the same branch name, like "git remote" did
+	remote = settings.get("remote") or next((section[1] for section in sections if section[0] == "remote"), "origin")
+	merge = settings.get("merge", "HEAD" if branch == "HEAD" else "refs/heads/" + branch)
+	return remote, merge
+
+def upstream(path, branch):
+	remote, merge = tracking(path, branch)
+	return "refs/remotes/" + remote + "/" + (merge[len("refs/heads/"):] if merge.startswith("refs/heads/") else merge)
+
+def tags(path):
+	# Every local tag and the object it points to, loose ones take precedence over packed ones
+	common = commondir(gitdir(path))
+	found = {ref[10:]: sha for ref, sha in packedrefs(common).items() if ref.startswith("refs/tags/")}
+	for root, dirs, files in os.walk(os.path.join(common, "refs", "tags")):
+		for name in files:
+			try:
+				with open(os.path.join(root, name), "r") as file:
+					found[os.path.relpath(os.path.join(root, name), os.path.join(common, "refs", "tags")).replace(os.sep, "/")] = file.read().strip()
+			except OSError:
+				pass
+	return found
+
+def snapshot(path):
+	with lock:
+		if path in snapshots:
+			return snapshots[path]
+	# A single call lists every ref, newest first, with the commit each one points to and its date
+	listing = run(["git", "for-each-ref", "--sort=-creatordate", "--format=" + "%00".join("%(" + field + ")" for field in FIELDS), "refs/heads", "refs/remotes", "refs/tags"], cwd = path, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+	refs = []
+	for line in listing.stdout.decode('utf-8', 'ignore').splitlines():
+		fields = line.split("\0")
+		if len(fields) == len(FIELDS):
+			refs.append({"ref": fields[0], "commit": fields[2] or fields[1], "date": int(fields[4] or fields[3] or 0)})
+	with lock:
+		snapshots[path] = refs
+	return refs
+
+def forget(path):
+	with lock:
+		snapshots.pop(path, None)
+
+def commitdate(path):
+	branch, sha = head(path)
+	for ref in snapshot(path):
+		if ref["commit"] == sha:
+			return ref["date"]
+	return None
+
+def relative(timestamp):
+	# Same wording git uses for relative dates
+	diff = max(int(time.time() - timestamp), 0)
+	plural = lambda amount, unit: str(amount) + " " + unit + ("s" if amount != 1 else "")
+	if diff < 90:
+		return plural(diff, "second") + " ago"
+	diff = (diff + 30) // 60
+	if diff < 90:
+		return plural(diff, "minute") + " ago"
+	diff = (diff + 30) // 60
+	if diff < 36:
+		return plural(diff, "hour") + " ago"
+	diff = (diff + 12) // 24
+	if diff < 14:
+		return plural(diff, "day") + " ago"
+	if diff < 70:
+		return plural((diff + 3) // 7, "week") + " ago"
+	if diff < 365:
+		return plural((diff + 15) // 30, "month") + " ago"
+	if diff < 1825:
+		months = (diff * 12 * 2 + 365) // (365 * 2)
+		if months % 12:
+			return plural(months // 12, "year") + ", " + plural(months % 12, "month") + " ago"
+		return plural(months // 12, "year") + " ago"
+	return plural((diff + 183) // 365, "year") + " ago"
+
+def release(tag, pattern):
+	# Tags must match the configured pattern, else they are filtered out by the usual prerelease markers
+	if pattern:
+		return re.search(pattern, tag) is not None
+	return not any(marker in tag for marker in NORELEASETAGS)
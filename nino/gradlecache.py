@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from .config import running
+
+# Resolves every configuration of every module without building anything, missing artifacts are ignored
+PREFETCH = '''allprojects {
+	tasks.register("ninoPrefetch") {
+		doLast {
+			project.configurations.findAll { it.canBeResolved }.each { configuration ->
+				try {
+					configuration.resolvedConfiguration.lenientConfiguration.artifacts*.file
+				} catch (Exception ignored) {
+				}
+			}
+		}
+	}
+}
+'''
+# Files that decide which dependencies a build needs
+DEPENDENCYFILES = ["gradle.properties", "libs.versions.toml", "gradle-wrapper.properties", "gradle.lockfile"]
+
+# Settings of the usual gradle home that builds would miss on the shared one: signing, proxies, jvm arguments and init scripts
+INHERITED = ["gradle.properties", "init.d"]
+
+lock = threading.Lock()
+# Dependency digests of the shared home that was last read, and the home that already got the user settings
+fingerprints, loaded = None, None
+inherited = None
+
+def home():
+	# Gradle user home shared by every project, next to them unless the configuration names another folder
+	folder = running["gradlecache"] if isinstance(running["gradlecache"], str) else ".nino-gradle"
+	return os.path.join(running["workdir"], folder)
+
+def flags(env):
+	# Point gradle to the shared home and let it reuse task outputs from any project
+	if not running["gradlecache"]:
+		return []
+	inherit()
+	env["GRADLE_USER_HOME"] = home()
+	return ["--build-cache"]
+
+def inherit():
+	# Link the settings of the gradle home the user would have had into the shared one, once per session and home
+	global inherited
+	with lock:
+		if inherited == home():
+			return
+		inherited = home()
+		source = os.environ.get("GRADLE_USER_HOME") or os.path.join(os.path.expanduser("~"), ".gradle")
+		if os.path.realpath(source) == os.path.realpath(home()):
+			return
+		os.makedirs(home(), exist_ok = True)
+		for name in INHERITED:
+			original, target = os.path.join(source, name), os.path.join(home(), name)
+			# Anything placed on the shared home on purpose is left alone, links are pointed again in case the user home moved
+			if not os.path.exists(original) or (os.path.exists(target) and not os.path.islink(target)):
+				continue
+			if os.path.islink(target):
+				os.remove(target)
+			try:
+				os.symlink(original, target, target_is_directory = os.path.isdir(original))
+			except (OSError, NotImplementedError):
+				# Unable to link, settings are copied and will not follow later changes to the user home
+				if os.path.isdir(original):
+					shutil.copytree(original, target)
+				else:
+					shutil.copy(original, target)
+
+def script():
+	path = os.path.join(home(), "nino-prefetch.gradle")
+	with lock:
+		if not os.path.isfile(path):
+			os.makedirs(home(), exist_ok = True)
+			with open(path, "w") as file:
+				file.write(PREFETCH)
+	return path
+
+def fingerprint(builddir):
+	# Digest of every build script, version catalog, lockfile and wrapper setting of the project
+	digest = hashlib.sha256()
+	for root, dirs, files in os.walk(builddir):
+		dirs[:] = sorted(name for name in dirs if not name.startswith(".") and name not in ["build", "node_modules"])
+		for name in sorted(files):
+			if name.endswith(".gradle") or name.endswith(".gradle.kts") or name.endswith(".lockfile") or name in DEPENDENCYFILES:
+				path = os.path.join(root, name)
+				digest.update(os.path.relpath(path, builddir).encode() + b"\0")
+				try:
+					with open(path, "rb") as file:
+						digest.update(file.read())
+				except OSError:
+					continue
+	return digest.hexdigest()
+
+def load():
+	global fingerprints, loaded
+	if fingerprints is None or loaded != home():
+		loaded = home()
+		try:
+			with open(os.path.join(home(), "nino-fingerprints.json"), "r") as file:
+				fingerprints = json.load(file)
+		except (OSError, ValueError):
+			fingerprints = {}
+	return fingerprints
+
+def known(name, digest):
+	# Whether the last successful build of the project needed the very same dependencies
+	if not running["gradlecache"]:
+		return False
+	with lock:
+		return load().get(name) == digest
+
+def remember(name, digest):
+	if not running["gradlecache"]:
+		return
+	with lock:
+		load()[name] = digest
+		os.makedirs(home(), exist_ok = True)
+		with open(os.path.join(home(), "nino-fingerprints.json"), "w") as file:
+			json.dump(fingerprints, file, indent = '\t')
+
+def size(path):
+	total = 0
+	for root, dirs, files in os.walk(path):
+		for name in files:
+			try:
+				total += os.lstat(os.path.join(root, name)).st_size
+			except OSError:
+				continue
+	return total
+
+def parts(folder):
+	# Where gradle keeps each kind of data inside its user home
+	return [("dependencies", os.path.join(folder, "caches", "modules-2")), ("build cache", os.path.join(folder, "caches", "build-cache-1")), ("distributions", os.path.join(folder, "wrapper", "dists"))]
+
+def show(folder):
+	if not os.path.isdir(folder):
+		print("There is no shared gradle cache on " + folder)
+		return
+	total = size(folder)
+	print("GRADLE CACHE ON " + folder + " (" + str(total // 1048576) + " MiB):")
+	for title, path in parts(folder):
+		amount = size(path)
+		total -= amount
+		print("     " + title + ": " + str(amount // 1048576) + " MiB")
+	print("     everything else: " + str(total // 1048576) + " MiB")
+
+def evict(folder, days):
+	# Build cache entries unused for the given days go away, zero days also drops every downloaded dependency
+	threshold, freed = time.time() - days * 86400, 0
+	for root, dirs, files in os.walk(os.path.join(folder, "caches", "build-cache-1")):
+		for name in files:
+			path = os.path.join(root, name)
+			try:
+				if os.path.getmtime(path) < threshold:
+					freed += os.path.getsize(path)
+					os.remove(path)
+			except OSError:
+				continue
+	if days == 0:
+		freed += size(os.path.join(folder, "caches", "modules-2"))
+		shutil.rmtree(os.path.join(folder, "caches", "modules-2"), ignore_errors = True)
+		# Nothing is known to be cached anymore so the next builds must go online
+		try:
+			os.remove(os.path.join(folder, "nino-fingerprints.json"))
+		except OSError:
+			pass
+	print("Evicted " + str(freed // 1048576) + " MiB from " + folder)
@@ -0,0 +1,91 @@
+import os
+import shutil
+import getpass
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+from .config import running
+from .metrics import Popen
+from .board import board
+
+class keyring():
+	def __init__(self):
+		# Keys that passed the check by keystore path, modification time and key, kept for the whole session
+		self.validated = set()
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		# Keys that failed are only given up on until the end of the run, the next one asks for their passwords again
+		self.rejected = set()
+
+	def identity(self, store, alias):
+		keystore = running["keystores"][store]
+		try:
+			modified = os.stat(keystore["path"]).st_mtime_ns
+		except OSError:
+			modified = None
+		# A keystore modified on disk must be checked again even if it was fine before
+		return (keystore["path"], modified, keystore["aliases"][alias]["name"])
+
+	def used(self):
+		keystores = running["keystores"]
+		return [(store, alias) for store in keystores if keystores[store].get("used", False) for alias in keystores[store]["aliases"] if keystores[store]["aliases"][alias].get("used", False)]
+
+	def prompt(self, pending):
+		# Passwords are asked one after another before any check starts so prompts never mix
+		keystores = running["keystores"]
+		with board.hold():
+			for store, alias in pending:
+				# If password was already read from config file we skip prompt
+				if "password" not in keystores[store]:
+					keystores[store]["password"] = getpass.getpass("Enter password of keystore '" + store + "' (" + keystores[store]["path"] + "): ")
+				if "password" not in keystores[store]["aliases"][alias]:
+					keystores[store]["aliases"][alias]["password"] = getpass.getpass("	 Enter password for key '" + alias + "' (" + keystores[store]["aliases"][alias]["name"] + ") of keystore '"+ store + "' (" + keystores[store]["path"] + "): ")
+
+	def check(self, store, alias):
+		# Returns whatever holds the rejected password, nothing if both were right
+		keystore = running["keystores"][store]
+		key = keystore["aliases"][alias]
+		# Test provided password by listing keystore to see if the alias actually exists
+		listing = Popen(["keytool", "-list", "-keystore", keystore["path"], "-alias", key["name"]], stdout = subprocess.DEVNULL, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		listing.communicate(input=keystore["password"].encode())
+		if listing.returncode != 0:
+			print("Keystore password is incorrect or alias '" + alias + "' (" + key["name"] + ") does not exist on keystore '" + store +"' (" + keystore["path"] + ")")
+			return keystore
+		# Attempt to export to a temporal keystore of our own to test the alias password, so checks can run at the same time
+		scratch = tempfile.mkdtemp(prefix = "nino-")
+		try:
+			testkey = Popen(["keytool", "-importkeystore", "-srckeystore", keystore["path"], "-destkeystore", os.path.join(scratch, "tmpstore"), "-deststorepass", "tmpstore", "-srcalias", key["name"]],  stdout = subprocess.DEVNULL, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+			# Generate the input using the two passwords and feed it to the subprocess
+			secrets = keystore["password"] + "\n" + key["password"]
+			testkey.communicate(input=secrets.encode())
+		finally:
+			shutil.rmtree(scratch, ignore_errors = True)
+		if testkey.returncode != 0:
+			print("Provided password for key '" + alias + "' (" + key["name"] + ") of keystore '" + store +"' (" + keystore["path"] + ") is incorrect")
+			return key
+		return None
+
+	def unlock(self, store, alias):
+		with self.lock:
+			if self.identity(store, alias) not in self.validated and self.identity(store, alias) not in self.rejected:
+				# The first output that needs signing checks every key the run will use, not just its own
+				pending = [(s, a) for s, a in self.used() if self.identity(s, a) not in self.validated and self.identity(s, a) not in self.rejected]
+				if (store, alias) not in pending:
+					pending.append((store, alias))
+				self.prompt(pending)
+				with concurrent.futures.ThreadPoolExecutor(max_workers = len(pending)) as executor:
+					results = list(executor.map(lambda entry: self.check(*entry), pending))
+				for entry, wrong in zip(pending, results):
+					if wrong is None:
+						self.validated.add(self.identity(*entry))
+					else:
+						self.rejected.add(self.identity(*entry))
+						# Forget the wrong password so it is asked again instead of failing forever
+						wrong.pop("password", None)
+			return self.identity(store, alias) in self.validated
+
+# Passwords and checked keys live as long as the process, so a daemon only asks for them once
+keys = keyring()
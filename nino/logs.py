@@ -0,0 +1,179 @@
+import os
+import re
+import gzip
+import json
+import time
+import threading
+import collections
+from .config import running
+
+# Lines starting with this byte are never written by the tools we run, so they can tell the reader what to do
+MARKER = b"\0nino:"
+
+class logstream():
+	def __init__(self, name, path, stage = "run", parent = None):
+		self.name = name
+		self.folder = os.path.join(path, "logs")
+		# Stages running at the same time, like installing to several devices, write on streams of their own that belong to the run of the project
+		self.root = parent or self
+		if parent is None:
+			os.makedirs(self.folder, exist_ok = True)
+			# Every file of the run shares the prefix so retention can tell runs apart
+			self.prefix = time.strftime("%Y%m%d-%H%M%S")
+			self.prune()
+			# Runs started within the same second keep numbering after each other instead of overwriting
+			self.count = len([name for name in os.listdir(self.folder) if name.startswith(self.prefix)])
+			self.numbering = threading.Lock()
+		else:
+			self.prefix = parent.prefix
+		# Last lines of the current stage, enough to tell why it failed without reading the whole log back
+		self.tail = collections.deque(maxlen = running["loglines"])
+		self.stage, self.target = stage, None
+		self.lock = threading.Lock()
+		self.closed = False
+		self.synced = threading.Condition()
+		self.pending, self.seen = 0, 0
+		# Children write on the pipe as if it was a file and a thread streams it into the compressed logs
+		self.reader, self.writer = os.pipe()
+		self.thread = threading.Thread(target = self.collect, daemon = True)
+		self.thread.start()
+		if parent is None:
+			streams[name] = self
+
+	def fileno(self):
+		# Allows passing the stream as stdout of subprocesses
+		return self.writer
+
+	def write(self, text):
+		data = text.encode() if isinstance(text, str) else text
+		with self.lock:
+			while data:
+				data = data[os.write(self.writer, data):]
+		return len(text)
+
+	def flush(self):
+		pass
+
+	def mark(self, stage):
+		# Goes through the pipe like the output does, so the switch happens exactly between stages
+		self.write(MARKER + b"stage:" + stage.encode() + b"\n")
+
+	def lines(self):
+		# Closed streams already read everything there was
+		if self.closed:
+			return list(self.tail)
+		# Wait until the reader caught up with everything written so far before looking at the tail
+		with self.synced:
+			self.pending += 1
+			ticket = self.pending
+		self.write(MARKER + b"sync\n")
+		with self.synced:
+			self.synced.wait_for(lambda: self.seen >= ticket or not self.thread.is_alive(), timeout = 10)
+			return list(self.tail)
+
+	def collect(self):
+		partial = b""
+		while True:
+			try:
+				chunk = os.read(self.reader, 65536)
+			except OSError:
+				chunk = b""
+			if not chunk:
+				break
+			lines = (partial + chunk).split(b"\n")
+			partial = lines.pop()
+			for line in lines:
+				self.line(line)
+		if partial:
+			self.line(partial)
+		self.rotate()
+		os.close(self.reader)
+		with self.synced:
+			self.synced.notify_all()
+
+	def line(self, line):
+		if line.startswith(MARKER):
+			command = line[len(MARKER):].decode("utf-8", "replace")
+			if command.startswith("stage:"):
+				self.rotate()
+				self.stage = command[len("stage:"):]
+				self.tail.clear()
+			elif command == "sync":
+				with self.synced:
+					self.seen += 1
+					self.synced.notify_all()
+			return
+		# Files are only created for stages that actually said something
+		if self.target is None:
+			with self.root.numbering:
+				self.root.count += 1
+				number = self.root.count
+			self.target = gzip.open(os.path.join(self.folder, self.prefix + "-" + format(number, "02") + "-" + re.sub(r"[^\w.-]", "_", self.stage) + ".log.gz"), "wb")
+		self.target.write(line + b"\n")
+		self.tail.append(line.decode("utf-8", "replace").rstrip("\r"))
+
+	def rotate(self):
+		if self.target is not None:
+			self.target.close()
+			self.target = None
+
+	def prune(self):
+		# Keep the logs of the last runs of the project, and fewer if they grow past the size limit
+		files = sorted((name for name in os.listdir(self.folder) if name.endswith(".log.gz")), reverse = True)
+		runs = []
+		for name in files:
+			if not runs or runs[-1][0] != name[:15]:
+				runs.append((name[:15], []))
+			runs[-1][1].append(name)
+		# The run about to start counts against the limit too
+		kept, total, limit = 1, 0, running["logsize"] * 1048576
+		for prefix, names in runs:
+			size = sum(os.path.getsize(os.path.join(self.folder, name)) for name in names)
+			if kept < running["logruns"] and total + size <= limit:
+				kept, total = kept + 1, total + size
+				continue
+			for name in names:
+				os.remove(os.path.join(self.folder, name))
+		# Measurements of the stages next to the logs only go as far back as the runs they keep
+		measures = os.path.join(os.path.dirname(self.folder), "stages.jsonl")
+		try:
+			with open(measures, "r") as file:
+				lines = file.readlines()
+		except OSError:
+			return
+		records = []
+		for line in lines:
+			try:
+				records.append((json.loads(line)["run"], line))
+			except (ValueError, KeyError, TypeError):
+				continue
+		# Newest runs first, as many as logs are kept for besides the run about to start
+		recent = []
+		for started, line in reversed(records):
+			if started not in recent:
+				recent.append(started)
+		recent = set(recent[:running["logruns"] - 1])
+		with open(measures + ".new", "w") as file:
+			file.writelines(line for started, line in records if started in recent)
+		os.replace(measures + ".new", measures)
+
+	def close(self):
+		if streams.get(self.name) is self:
+			del streams[self.name]
+		self.closed = True
+		os.close(self.writer)
+		# Something that outlived its stage may still hold the pipe, never wait on it forever
+		self.thread.join(timeout = 10)
+
+# Open stream of each project, so stages can be marked without knowing about the project itself
+streams = {}
+
+def mark(project, stage):
+	if project in streams:
+		streams[project].mark(stage)
+
+def excerpt(logfile, indent = "          "):
+	# Last lines written during the stage that just failed, right under the status line
+	lines = logfile.lines() if isinstance(logfile, logstream) else []
+	for line in lines:
+		print(indent + "| " + line)
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import subprocess
+from .config import running
+from .statics import stagekinds
+from .logs import mark
+
+# Stage being measured by each thread, so children know where to charge what they used
+local = threading.local()
+
+class Popen(subprocess.Popen):
+	# Children are reaped with wait4 so the resources they used can be charged to the stage that started them.
+	# Only the public wait() and poll() are replaced, communicate() and leaving the with block wait through them.
+	def __init__(self, *args, **kwargs):
+		# Remember the stage now, the child may be waited from a different thread
+		self.stage = getattr(local, "stage", None)
+		super().__init__(*args, **kwargs)
+
+	def reap(self, flags):
+		try:
+			pid, status, usage = os.wait4(self.pid, flags)
+		except ChildProcessError:
+			# Same as subprocess does when somebody else reaped it
+			if self.returncode is None:
+				self.returncode = 0
+			return
+		if pid == self.pid:
+			# Long lived children are charged to whatever stage ends up waiting for them
+			charge(usage, getattr(local, "stage", None) or self.stage)
+			self.returncode = os.waitstatus_to_exitcode(status)
+
+	if hasattr(os, "wait4"):
+		def poll(self):
+			if self.returncode is None:
+				self.reap(os.WNOHANG)
+			return self.returncode
+
+		def wait(self, timeout = None):
+			if self.returncode is None and timeout is None:
+				self.reap(0)
+			deadline = None if timeout is None else time.monotonic() + timeout
+			# Nothing blocks for a limited time on wait4, so poll until the child is done
+			while self.returncode is None:
+				self.reap(os.WNOHANG)
+				if self.returncode is None:
+					if time.monotonic() >= deadline:
+						raise subprocess.TimeoutExpired(self.args, timeout)
+					time.sleep(min(0.05, max(deadline - time.monotonic(), 0)))
+			return self.returncode
+
+def charge(usage, record):
+	if record is None:
+		return
+	# Linux reports the peak resident size in KiB, macOS does it in bytes
+	rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+	with recorder.lock:
+		record["cpu"] = round(record["cpu"] + usage.ru_utime + usage.ru_stime, 3)
+		record["rss"] = max(record["rss"], rss)
+		record["children"] += 1
+
+def call(*args, timeout = None, **kwargs):
+	# Drop-in for subprocess.call with the child measured
+	with Popen(*args, **kwargs) as process:
+		try:
+			return process.wait(timeout = timeout)
+		except:
+			process.kill()
+			raise
+
+def run(*args, input = None, timeout = None, **kwargs):
+	# Drop-in for subprocess.run (without check nor capture_output) with the child measured
+	with Popen(*args, **kwargs) as process:
+		try:
+			stdout, stderr = process.communicate(input, timeout = timeout)
+		except:
+			process.kill()
+			raise
+	return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+
+class stagerecorder():
+	def __init__(self):
+		self.records = []
+		self.started = None
+		self.lock = threading.Lock()
+
+	def begin(self):
+		self.records = []
+		self.started = time.time()
+
+	@contextlib.contextmanager
+	def stage(self, project, name, path = None):
+		# Wall time of the whole stage plus cpu time and peak memory of every child it started
+		record = {"run": self.started, "project": project, "stage": name, "start": round(time.time(), 3), "wall": 0.0, "cpu": 0.0, "rss": 0, "children": 0}
+		previous, local.stage = getattr(local, "stage", None), record
+		# Output of the stage goes to its own log file
+		mark(project, name)
+		clock = time.perf_counter()
+		try:
+			yield record
+		except:
+			record["result"] = "error"
+			raise
+		finally:
+			record["wall"] = round(time.perf_counter() - clock, 3)
+			local.stage = previous
+			with self.lock:
+				self.records.append(record)
+				# Kept next to the logs so the whole story of a project is on its folder
+				if path:
+					with open(os.path.join(path, "stages.jsonl"), "a") as file:
+						file.write(json.dumps(record) + "\n")
+
+	def summary(self):
+		# Roll every stage of the run up into sync, build, sign and deploy time per project
+		projects = {}
+		for record in self.records:
+			kind = stagekinds.get(record["stage"].split(":")[0], "other")
+			totals = projects.setdefault(record["project"] or "", {})
+			totals[kind] = round(totals.get(kind, 0) + record["wall"], 3)
+			totals["cpu"] = round(totals.get("cpu", 0) + record["cpu"], 3)
+			totals["rss"] = max(totals.get("rss", 0), record["rss"])
+		return {"start": self.started, "wall": round(time.time() - self.started, 3), "children": sum(record["children"] for record in self.records), "projects": projects}
+
+	def finish(self):
+		summary = self.summary()
+		# Like the logs, only the last runs of each project are kept, runs where every project is older go away
+		seen, kept = {}, []
+		for entry in reversed(history(running["workdir"]) + [summary]):
+			names = [name for name in entry["projects"] if name]
+			for name in names:
+				seen[name] = seen.get(name, 0) + 1
+			if any(seen[name] <= running["logruns"] for name in names):
+				kept.append(entry)
+		with open(os.path.join(running["workdir"], ".nino-runs.new"), "w") as file:
+			for entry in reversed(kept):
+				file.write(json.dumps(entry) + "\n")
+		os.replace(os.path.join(running["workdir"], ".nino-runs.new"), os.path.join(running["workdir"], ".nino-runs"))
+		print("------------------------------------------")
+		print("RUN SUMMARY (" + duration(summary["wall"]) + " total, " + str(summary["children"]) + " processes):")
+		for project in sorted(summary["projects"], key = lambda name: -sum(summary["projects"][name].get(kind, 0) for kind in ["sync", "build", "sign", "deploy"])):
+			totals = summary["projects"][project]
+			print("     " + (project or "(run)") + ": " + ", ".join(kind + " " + duration(totals[kind]) for kind in ["sync", "build", "sign", "deploy"] if kind in totals) + ", cpu " + duration(totals["cpu"]) + ", peak " + str(totals["rss"] // 1024) + " MiB")
+		return summary
+
+# Every stage of every project ends up on the same record of the run
+recorder = stagerecorder()
+stage = recorder.stage
+
+def duration(seconds):
+	# Short stages are shown with tenths so they do not all look the same
+	if seconds < 10:
+		return format(seconds, ".1f") + "s"
+	minutes, seconds = divmod(int(round(seconds)), 60)
+	return str(minutes) + "m" + format(seconds, "02") + "s" if minutes else str(seconds) + "s"
+
+def history(workdir, limit = None):
+	# Summaries of previous runs, oldest first
+	runs = []
+	try:
+		with open(os.path.join(workdir, ".nino-runs"), "r") as file:
+			for line in file:
+				try:
+					runs.append(json.loads(line))
+				except ValueError:
+					continue
+	except OSError:
+		pass
+	return runs[-limit:] if limit else runs
+
+def report(workdir, limit = 10):
+	runs = history(workdir, limit)
+	if not runs:
+		print("No runs were recorded yet on " + workdir)
+		return
+	print("LAST " + str(len(runs)) + " RUNS:")
+	for summary in runs:
+		print("     " + time.strftime("%Y-%m-%d %H:%M", time.localtime(summary["start"])) + " - " + duration(summary["wall"]) + ", " + str(len(summary["projects"])) + " projects, " + str(summary.get("children", 0)) + " processes")
+	print("------------------------------------------")
+	# For every project show how long each stage took on each run, from older to newer, and the change over the average
+	names = sorted(set(name for summary in runs for name in summary["projects"] if name))
+	for name in names:
+		print(name + ":")
+		for kind in ["sync", "build", "sign", "deploy"]:
+			values = [summary["projects"][name][kind] for summary in runs if kind in summary["projects"].get(name, {})]
+			if not values:
+				continue
+			average = sum(values) / len(values)
+			trend = "" if len(values) < 2 or not average else " (" + format((values[-1] - average) / average * 100, "+.0f") + "% over average)"
+			print("     " + kind + ": " + " ".join(duration(value) for value in values) + trend)
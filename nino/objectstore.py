@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+import subprocess
+from . import gitrefs
+from .config import running
+from .metrics import call
+
+# A single bare repository holding the objects every sharing project has in common
+STORE = ".nino-objects"
+# Only one project at a time may write to the store
+lock = threading.Lock()
+
+def store(logfile):
+	path = os.path.join(running["workdir"], STORE)
+	if not os.path.isdir(path):
+		call(["git", "init", "--bare", "-q", path], stdout = logfile, stderr = subprocess.STDOUT)
+		# Projects rely on the objects of the store so it must never drop any of them on its own
+		for key, value in [("gc.auto", "0"), ("gc.pruneExpire", "never"), ("core.logAllRefUpdates", "false")]:
+			call(["git", "config", key, value], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+	return path
+
+def configure(path, shared, partial, logfile):
+	git = gitrefs.commondir(gitrefs.gitdir(path))
+	# Borrow objects from the store, fetches will then only download what no sharing project has yet
+	if shared:
+		with lock:
+			objects = os.path.join(store(logfile), "objects")
+		alternates = os.path.join(git, "objects", "info", "alternates")
+		try:
+			with open(alternates, "r") as file:
+				known = [line.strip() for line in file]
+		except OSError:
+			known = []
+		if objects not in known:
+			os.makedirs(os.path.dirname(alternates), exist_ok = True)
+			with open(alternates, "a") as file:
+				file.write(objects + "\n")
+	# Partial clones only download the blobs that are actually checked out
+	if partial:
+		branch, head = gitrefs.head(path)
+		remote, merge = gitrefs.tracking(path, branch or "HEAD")
+		if gitrefs.config(path).get(("remote", remote), {}).get("partialclonefilter") != partial:
+			call(["git", "config", "remote." + remote + ".promisor", "true"], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+			call(["git", "config", "remote." + remote + ".partialclonefilter", partial], cwd = path, stdout = logfile, stderr = subprocess.STDOUT)
+
+def absorb(name, path, logfile):
+	# Copy what the project just fetched into the store, under its own namespace so forks never clash
+	with lock:
+		fetch = call(["git", "--git-dir=" + store(logfile), "fetch", "--no-tags", "-q", path, "+refs/remotes/*:refs/projects/" + name + "/remotes/*", "+refs/tags/*:refs/projects/" + name + "/tags/*"], stdout = logfile, stderr = subprocess.STDOUT)
+	return fetch == 0
+
+def due(git, interval):
+	# Each repository remembers when it was last maintained
+	if not interval:
+		return False
+	try:
+		return time.time() - os.path.getmtime(os.path.join(git, "nino-maintenance")) >= interval
+	except OSError:
+		return True
+
+def maintain(path, shared, interval, logfile):
+	git = gitrefs.commondir(gitrefs.gitdir(path))
+	# Objects found on the store are dropped from the project, the rest end up on a single pack
+	commands = [["git", "repack", "-a", "-d", "-q"] + (["-l"] if shared else []), ["git", "commit-graph", "write", "--reachable"], ["git", "pack-refs", "--all"]]
+	done = all(call(command, cwd = path, stdout = logfile, stderr = subprocess.STDOUT) == 0 for command in commands)
+	if shared:
+		with lock:
+			common = store(logfile)
+			# The store keeps unreachable objects, some project may still need them
+			if due(common, interval):
+				done = all(call(command[:1] + ["--git-dir=" + common] + command[1:], stdout = logfile, stderr = subprocess.STDOUT) == 0 for command in [["git", "repack", "-a", "-d", "-q", "--keep-unreachable"], ["git", "commit-graph", "write", "--reachable"], ["git", "pack-refs", "--all"]]) and done
+				touch(common)
+	touch(git)
+	return done
+
+def touch(git):
+	with open(os.path.join(git, "nino-maintenance"), "w"):
+		pass
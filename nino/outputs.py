@@ -0,0 +1,67 @@
+import os
+import re
+import json
+import pathlib
+
+def outputdirs(path):
+	# Walk the project only as deep as needed to find the apk output directory of every gradle module
+	for root, dirs, files in os.walk(path):
+		if os.path.basename(root) == "build":
+			apkdir = os.path.join(root, "outputs", "apk")
+			if os.path.isdir(apkdir):
+				yield apkdir
+			# Anything else inside a build directory are intermediates
+			dirs.clear()
+		else:
+			# Hidden directories (.git, .gradle...) and node modules never contain gradle outputs
+			dirs[:] = [name for name in dirs if not name.startswith(".") and name != "node_modules"]
+
+def discover(path, since = 0):
+	# Retrieve the apks written on gradle output directories after the given timestamp, relative to the project
+	apks = []
+	for apkdir in outputdirs(path):
+		for root, dirs, files in os.walk(apkdir):
+			for name in files:
+				apk = os.path.join(root, name)
+				if name.endswith(".apk") and os.stat(apk).st_mtime >= since:
+					apks.append(os.path.relpath(apk, path))
+	return apks
+
+def words(name):
+	# Split a camel cased name ("freeStagingRelease") into its capitalized parts
+	return re.findall("[A-Z][^A-Z]*", name[:1].upper() + name[1:])
+
+def variantname(task):
+	# Only assemble tasks produce apks, whatever follows the verb names the flavours and build type they cover
+	name = task.split(":")[-1]
+	if not name.startswith("assemble"):
+		return None
+	return words(name[len("assemble"):])
+
+def covers(selector, variant):
+	# Gradle has aggregate tasks for every flavour and build type, so "Release", "Free" and "FreeRelease" all cover "freeRelease"
+	parts = words(variant)
+	return any(parts[index:index + len(selector)] == selector for index in range(len(parts) - len(selector) + 1))
+
+def variantoutputs(path, builddir, task):
+	selector = variantname(task)
+	if selector is None:
+		return []
+	# A task with a module path (":app:assembleRelease") only assembles that module
+	modules = [module for module in task.split(":")[:-1] if module]
+	apks = []
+	metadatas = [metadata for apkdir in outputdirs(os.path.join(builddir, *modules)) for metadata in pathlib.Path(apkdir).glob("**/output-metadata.json")]
+	for metadata in metadatas:
+		try:
+			with open(metadata, "r") as file:
+				content = json.load(file)
+		except (OSError, ValueError):
+			continue
+		if not covers(selector, content.get("variantName", "")):
+			continue
+		# Each element of the metadata is an output of the variant, named relative to the metadata file
+		for element in content.get("elements", []):
+			apk = metadata.parent / element.get("outputFile", "")
+			if apk.suffix == ".apk" and apk.is_file():
+				apks.append(str(apk.relative_to(path)))
+	return apks
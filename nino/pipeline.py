@@ -0,0 +1,164 @@
+import concurrent.futures
+from .config import running, retryconfig
+from .scheduler import scheduler
+from .daemons import pool
+from .signer import signers
+from .metrics import stage
+from .planner import longest
+from .board import board
+from .logs import logstream
+from .utils import cprint
+
+class pipeline():
+	def __init__(self, apps, estimates):
+		self.apps, self.estimates = apps, estimates
+		# Each stage has its own workers so a project can be building while another one signs and a third one deploys
+		self.syncer = concurrent.futures.ThreadPoolExecutor(max_workers = running["syncjobs"])
+		self.builder = scheduler(running["buildjobs"], task = self.build, priority = lambda app: -estimates[app.name]["build"])
+		# Signing may prompt for passwords and deploying shares the devices, so those go one project at a time
+		self.signer = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+		self.deployer = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+		# Repository maintenance never delays other projects, it runs once a project is done with everything else
+		self.maintainer = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+
+	def run(self):
+		print("------------------------------------------")
+		print("RUNNING " + str(len(self.apps)) + " PROJECTS (" + str(running["syncjobs"]) + " syncing and " + str(self.builder.jobs) + " building at a time, " + str(self.builder.cores) + " cores, " + str(self.builder.memory) + " MiB free):")
+		board.begin([app.name for app in self.apps])
+		try:
+			self.builder.start()
+			for app in longest(self.apps, self.estimates, "sync"):
+				self.syncer.submit(self.guard, self.sync, app)
+			# Every stage is drained in order, as each one only feeds the ones after it
+			self.syncer.shutdown(wait = True)
+			self.builder.close()
+			# Nothing else will be built so warm gradle daemons are no longer needed
+			pool.stopall()
+			self.signer.shutdown(wait = True)
+			# Signing is over so the keys can leave memory
+			with stage(None, "signer"):
+				signers.stopall()
+			self.deployer.shutdown(wait = True)
+			self.maintainer.shutdown(wait = True)
+		finally:
+			board.end()
+		print("------------------------------------------")
+		print("RESULTS:")
+		for app in self.apps:
+			print("     " + app.name + " - ", end = "")
+			cprint(board.states[app.name].upper(), {"done": "correct", "skipped": "warning"}.get(board.states[app.name], "error"))
+
+	def guard(self, step, app):
+		# A crash on one project must never take the rest of the pipeline down
+		try:
+			step(app)
+		except Exception as error:
+			self.crash(app, error)
+
+	def crash(self, app, error):
+		cprint("     " + app.name + ": " + str(error), "error")
+		# Saved for retrying like any other failure, and nothing after the broken stage runs
+		app.crashed()
+		self.close(app, "failed")
+
+	def sync(self, app):
+		board.update(app.name, "syncing")
+		with board.section():
+			# Introduce the project
+			app.presentation()
+			# If the project is set for retry skip normal execution and save previous config
+			if app.name in retryconfig and not app.force and not app.retrying:
+				cprint("Project is set for retry, skipping.", "warning")
+				cprint("Once fixed, rebuild via 'nino -r' or 'nino -f " + app.name, "warning")
+				app.failed = retryconfig[app.name]
+				board.update(app.name, "skipped")
+				return
+			# Output of each operation is streamed into compressed logs, one per stage
+			app.logfile = logstream(app.name, app.path)
+			# Only pull changes from remote without touching the working tree
+			if app.sync and app.fetcher.type:
+				app.remote()
+			# Sync the project
+			if app.sync:
+				app.fetch()
+			elif app.isolated and app.build and app.force and app.sources == app.path:
+				app.isolation()
+		# Only attempt gradle projects with build enabled and are either forced or have new changes, as many at once as the host allows
+		if app.build and (app.changed or app.force):
+			# Resolving dependencies runs gradle as well, so it waits for the same cores and memory a build would
+			if running["gradlecache"]:
+				board.update(app.name, "waiting to prefetch")
+				self.builder.submit(app, self.prefetch)
+			else:
+				board.update(app.name, "waiting to build")
+				self.builder.submit(app)
+		else:
+			self.signing(app)
+
+	def prefetch(self, app):
+		board.update(app.name, "prefetching")
+		try:
+			with board.section(app.name):
+				app.prefetch()
+		except Exception as error:
+			self.crash(app, error)
+			return
+		# The build queues on its own, so a project that goes first may take the slot meanwhile
+		board.update(app.name, "waiting to build")
+		self.builder.submit(app)
+
+	def build(self, app):
+		board.update(app.name, "building")
+		try:
+			with board.section(app.name):
+				app.package()
+		except Exception as error:
+			self.crash(app, error)
+			return
+		self.signing(app)
+
+	def signing(self, app):
+		# Only outputs that were just built or are left from a previous run need signing, reused ones are already released
+		if app.signlist:
+			board.update(app.name, "waiting to sign")
+			self.signer.submit(self.guard, self.sign, app)
+		else:
+			self.deploying(app)
+
+	def sign(self, app):
+		board.update(app.name, "signing")
+		with board.section(app.name):
+			app.sign()
+		self.deploying(app)
+
+	def deploying(self, app):
+		# We deploy if we have something to deploy
+		if app.deploylist:
+			board.update(app.name, "waiting to deploy")
+			self.deployer.submit(self.guard, self.deploy, app)
+		else:
+			self.finish(app)
+
+	def deploy(self, app):
+		board.update(app.name, "deploying")
+		with board.section(app.name):
+			app.install()
+		self.finish(app)
+
+	def finish(self, app, state = None):
+		if state is None and app.maintainable():
+			board.update(app.name, "waiting to maintain")
+			self.maintainer.submit(self.guard, self.maintain, app)
+		else:
+			self.close(app, state)
+
+	def maintain(self, app):
+		board.update(app.name, "maintaining")
+		with board.section(app.name):
+			app.maintain()
+		self.close(app)
+
+	def close(self, app, state = None):
+		if getattr(app, "logfile", None):
+			app.logfile.close()
+		board.update(app.name, state or ("failed" if app.failed else "done"))
@@ -0,0 +1,83 @@
+import os
+import time
+import heapq
+from .config import running
+from .metrics import history, duration
+
+# Weight of the newest run on the moving average kept for each project
+SMOOTHING = 0.3
+# Assumptions for projects nino never saw working: seconds to build each MiB of sources and seconds to sync
+BUILDRATE = 2.0
+SYNCTIME = 10.0
+
+def averages(workdir):
+	# Exponential moving average of the time each project spent on every part of the run
+	known = {}
+	for summary in history(workdir):
+		for name, totals in summary["projects"].items():
+			for kind in [kind for kind in ["sync", "build", "sign", "deploy"] if name and kind in totals]:
+				current = known.setdefault(name, {}).get(kind)
+				known[name][kind] = totals[kind] if current is None else SMOOTHING * totals[kind] + (1 - SMOOTHING) * current
+	return known
+
+def sourcesize(path):
+	# Bytes of everything but version control, build outputs and caches
+	total = 0
+	for root, dirs, files in os.walk(path):
+		dirs[:] = [name for name in dirs if not name.startswith(".") and name not in ["build", "node_modules"]]
+		for name in files:
+			try:
+				total += os.lstat(os.path.join(root, name)).st_size
+			except OSError:
+				continue
+	return total
+
+def estimate(apps):
+	# Expected seconds of each part of the run per project, taken from history or guessed from its size
+	known = averages(running["workdir"])
+	syncs = sorted(known[name]["sync"] for name in known if "sync" in known[name])
+	# Without history a project syncs like the typical one does
+	typical = syncs[len(syncs) // 2] if syncs else SYNCTIME
+	estimates = {}
+	for app in apps:
+		entry = dict(known.get(app.name, {}))
+		# Remember where each figure came from so plans can tell guesses apart
+		entry["origin"] = {kind: "history" for kind in entry}
+		if "sync" not in entry:
+			entry["sync"], entry["origin"]["sync"] = typical, "typical"
+		if "build" not in entry:
+			entry["build"], entry["origin"]["build"] = sourcesize(app.path) / 1048576 * BUILDRATE, "size"
+		estimates[app.name] = entry
+	return estimates
+
+def longest(apps, estimates, kind):
+	# Starting the longest work first keeps a big project from being the only thing left running at the end
+	return sorted(apps, key = lambda app: -estimates[app.name][kind])
+
+def schedule(apps, estimates, kind, slots):
+	# Greedy simulation of the pool: each project goes to the slot that gets free first
+	free, plan = [0.0] * max(slots, 1), []
+	heapq.heapify(free)
+	for app in longest(apps, estimates, kind):
+		start = heapq.heappop(free)
+		plan.append((app, start, start + estimates[app.name][kind]))
+		heapq.heappush(free, start + estimates[app.name][kind])
+	return plan, max(free)
+
+def show(apps):
+	estimates = estimate(apps)
+	syncing = [app for app in apps if app.sync and app.fetcher.type]
+	building = [app for app in apps if app.build]
+	elapsed = 0.0
+	for title, selected, kind, slots in [("SYNCING REMOTES", syncing, "sync", running["syncjobs"]), ("BUILDING PACKAGES", building, "build", running["buildjobs"])]:
+		print("------------------------------------------")
+		print("PLANNED " + title + " (" + str(len(selected)) + " projects, " + str(slots) + " at a time):")
+		plan, span = schedule(selected, estimates, kind, slots)
+		for app, start, end in plan:
+			print("     " + app.name + " - starts at +" + duration(elapsed + start) + ", takes " + duration(end - start) + " (" + estimates[app.name]["origin"][kind] + ")")
+		elapsed += span
+	# Signing and deploying still go one project after another
+	tail = sum(estimates[app.name].get("sign", 0) + estimates[app.name].get("deploy", 0) for app in building)
+	elapsed += tail
+	print("------------------------------------------")
+	print("PREDICTED FINISH: " + time.strftime("%H:%M", time.localtime(time.time() + elapsed)) + " (" + duration(elapsed) + " if every project had to be built, " + duration(tail) + " of them signing and deploying)")
@@ -1,149 +1,457 @@
 import os
-import pathlib
 import re
+import json
+import time
+import hashlib
 import subprocess
-import copy
+import concurrent.futures
 from .config import running
-from .utils import cprint
-from .fetchmethods import fetchmethod
-from .statics import execprefix, execsuffix, workdir, defconfig
+from .utils import cprint, cstatus
+from . import gitrefs, objectstore
+from .fetchmethods import fetchmethod, git
+from .daemons import pool
+from . import gradlecache
+from .cache import cache
+from .releases import releases
+from .keystores import keys
+from .signer import signers, done
+from .devices import devices
+from .apk import identity, inspect, realign
+from .outputs import variantoutputs, discover
+from .statics import execprefix, execsuffix, defconfig
+from .metrics import call, Popen, stage
+from .logs import logstream, excerpt
 
 class project():
-	def __init__(self, name):
+	def __init__(self, name, force = False, retry = None):
 		self.name = name
-		pconfig = running["projects"].get(name, {})
+		# Absolute location of the project so it can be handled from the invocation directory
+		self.path = os.path.join(running["workdir"], name)
+		# Retrying a single project takes the settings saved when it failed, like retry mode does for every project
+		self.retrying = running["retry"] or retry is not None
+		pconfig = running["projects"].get(name, {}) if retry is None else retry
+		default = running["projects"]["default"] if retry is None else defconfig
 		# Retrieve value for each property except for force because has different types
 		for prop in defconfig:
-			setattr(self, prop, pconfig.get(prop, running["projects"]["default"][prop]))
+			setattr(self, prop, pconfig.get(prop, default[prop]))
 		# Detect the valid fetching method even when fetching is disabled because is needed on presentation
-		self.fetcher = fetchmethod()
+		self.fetcher = fetchmethod(self.path)
 		# Remember subdir in case we need it for retries
 		self.subdir = pconfig.get("subdir", False)
+		# Builds isolated on git worktrees check out each revision next to the project instead of on it
+		self.isolated = self.worktree and self.fetcher.type == "git"
+		self.worktrees = os.path.join(running["workdir"], ".nino-worktrees", name)
+		self.sources = self.checkout() if self.isolated else self.path
+		# Gradle runs from the subdir if the project specifies one
+		self.builddir = os.path.join(self.sources, self.subdir) if self.subdir else self.sources
 		# Forcing stores a list from cmdargs and a bool on project so check both
-		self.force = name in running["force"] or pconfig.get("force", False)
+		self.force = force or name in running["force"] or pconfig.get("force", False)
 		# Some properties are only generated by nino in the scope of retrying so avoid user interference
-		self.signlist = pconfig.get("signlist", {}) if running["retry"] else {}
-		self.deploylist = pconfig.get("deploylist", {}) if running["retry"] else {}
+		self.signlist = pconfig.get("signlist", {}) if self.retrying else {}
+		self.deploylist = pconfig.get("deploylist", {}) if self.retrying else {}
 		# Some properties are exclusive for the run
 		self.changed, self.built, self.failed, self.releases = False, 1, {}, set()
+		# Result of fetching the remote, stays as None until it is attempted, and whether the remote had nothing new
+		self.fetched, self.unchanged = None, False
+		# Whether what was fetched made it into the store shared with other projects, None when not sharing
+		self.absorbed = None
+		# Exact state of the sources, known once the project is about to be built or signed
+		self.revision = None
 
 	def presentation(self):
 		# Retrieve and show basic information about the project
 		print("------------------------------------------")
 		print(self.name + " - last updated " + self.fetcher.lastdate)
 
+	def crashed(self):
+		# Something unexpected broke the project halfway, so retrying it must go through everything again
+		self.failed.update({"sync": self.sync, "followtags": self.followtags, "preserve": self.preserve, "worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+
+	def remote(self):
+		# Only pull changes from remote without touching the working tree, this is safe to run concurrently with other projects
+		with stage(self.name, "fetch", self.path):
+			try:
+				# Ask the remote if it has anything new before paying for a full fetch
+				if running["probe"] and not self.fetcher.probe(self.followtags, self.logfile):
+					self.fetched, self.unchanged = True, True
+				else:
+					self.fetched = self.download()
+			except OSError as error:
+				print(error, file = self.logfile, flush = True)
+				self.fetched = False
+		return self.fetched
+
+	def download(self):
+		# Git projects may borrow objects from the store shared with other projects and skip part of the history
+		if self.fetcher.type == "git":
+			objectstore.configure(self.path, self.shared, self.partial, self.logfile)
+		fetched = self.fetcher.fetch(self.logfile, self.depth)
+		# Whatever was downloaded becomes available to the rest of sharing projects
+		if fetched and self.shared and self.fetcher.type == "git":
+			self.absorbed = objectstore.absorb(self.name, self.path, self.logfile)
+			if not self.absorbed:
+				print("Could not copy the fetched objects into the shared store", file = self.logfile, flush = True)
+		return fetched
+
+	def maintainable(self):
+		# Only git repositories that were synced on this run and are due for it
+		return self.fetched is not None and self.fetcher.type == "git" and objectstore.due(gitrefs.commondir(gitrefs.gitdir(self.path)), self.maintenance)
+
+	def maintain(self):
+		print("     MAINTAINING REPOSITORY - ", end = "", flush = True)
+		with stage(self.name, "maintain", self.path):
+			done = objectstore.maintain(self.path, self.shared, self.maintenance, self.logfile)
+		if done:
+			cprint("SUCCESSFUL", "correct")
+		else:
+			# Nothing to retry, maintenance is attempted again on the next run
+			cprint("FAILED", "error")
+			excerpt(self.logfile)
+
 	def fetch(self):
+		self.synchronize()
+		# Sharing projects keep working on their own objects, but the rest will download them again
+		if self.absorbed is False:
+			cstatus("     SHARING OBJECTS", "FAILED", "warning")
+
+	def synchronize(self):
 		# Without any valid fetching methods we skip syncing
 		if not self.fetcher.type:
 			cprint("No valid fetching method available", "warning")
 			return
 		print("SYNCING SOURCE CODE (" + self.fetcher.type + "):")
 		print("     FETCHING REMOTE - ", end = "", flush = True)
-		# Pull changes from remote and proceed if it went fine
-		if self.fetcher.fetch(self.logfile):
+		# The remote was already pulled during the sync stage unless the project skipped it
+		if self.fetched is None:
+			with stage(self.name, "fetch", self.path):
+				self.fetched = self.download()
+		# Worktree builds leave the project folder alone and check out the new revision on their own
+		if self.fetched and self.isolated:
+			self.isolate()
+		# Proceed only if pulling changes from remote went fine
+		elif self.fetched:
 			# Check if there are new changes available before proceeding, else we stop here
-			checker = self.fetcher.newtag() if self.followtags else self.fetcher.updated()
+			with stage(self.name, "merge", self.path):
+				checker = self.fetcher.newtag(self.tagpattern) if self.followtags else self.fetcher.updated()
 			if checker[0]:
 				cprint("UPDATED", "correct")
 				# Now we must merge changes into working tree
 				print("     MERGING REMOTE - ", end = "", flush = True)
 				# Store the current local diff to restore it later if enabled
-				if self.preserve:
-					diff = self.fetcher.changes()
-				merger = self.fetcher.tagswap(self.logfile, checker[1]) if self.followtags else self.fetcher.merge(self.logfile)
+				with stage(self.name, "merge", self.path):
+					if self.preserve:
+						diff = self.fetcher.changes()
+					merger = self.fetcher.tagswap(self.logfile, checker[1]) if self.followtags else self.fetcher.merge(self.logfile)
 				if merger:
 					self.changed = True
 					cprint("SUCCESSFUL", "correct")
 				else:
 					# Merging went bad
-					self.failed.update({"sync": self.sync, "followtags": self.followtags, "preserve": self.preserve, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.force, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+					self.failed.update({"sync": self.sync, "followtags": self.followtags, "preserve": self.preserve, "worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.force, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
 					cprint("FAILED", "error")
+					excerpt(self.logfile)
 				# Now try to restore the local changes if they actually exist
 				if self.preserve and diff.decode() != "":
 					print("     RESTORING LOCAL CHANGES - ", end = "", flush = True)
-					if self.fetcher.restore(diff, self.logfile):
+					with stage(self.name, "restore", self.path):
+						restored = self.fetcher.restore(diff, self.logfile)
+					if restored:
 						cprint("SUCCESSFUL", "correct")
 					else:
 						# Failure on restore means we skip building for this run to allow the user to fix the conflict once
-						self.failed.update({"sync": not self.changed, "followtags": self.followtags, "preserve": self.preserve, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.changed, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+						self.failed.update({"sync": not self.changed, "followtags": self.followtags, "preserve": self.preserve, "worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.changed, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
 						self.build = False
 						cprint("FAILED", "error")
+						excerpt(self.logfile)
 			else:
 				cprint("UNCHANGED", "warning")
 				return
 		else:
 			# Pulling went bad :(
-			self.failed.update({"sync": self.sync, "followtags": self.followtags, "preserve": self.preserve, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.force, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+			self.failed.update({"sync": self.sync, "followtags": self.followtags, "preserve": self.preserve, "worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.force, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
 			cprint("FAILED", "error")
+			excerpt(self.logfile)
+
+	def checkout(self):
+		# Worktree the last revision was checked out on, the project folder itself until there is one
+		try:
+			with open(os.path.join(self.worktrees, "current"), "r") as file:
+				folder = os.path.join(self.worktrees, file.read().strip())
+		except OSError:
+			return self.path
+		return folder if os.path.isfile(os.path.join(folder, ".git")) else self.path
+
+	def isolate(self, target = None):
+		if target is None:
+			with stage(self.name, "merge", self.path):
+				target = self.fetcher.target(self.followtags, self.tagpattern)
+		previous, current = gitrefs.head(self.sources)[1], self.sources != self.path
+		# Until there is a worktree the first one is made, at least with whatever the project folder has checked out
+		target = target or (None if current else previous)
+		if not target or (current and target == previous):
+			cprint("UNCHANGED", "warning")
+			return
+		cprint("UPDATED" if target != previous else "UNCHANGED", "correct" if target != previous else "warning")
+		print("     CHECKING OUT WORKTREE - ", end = "", flush = True)
+		# Two worktrees take turns so the previous revision stays intact until the new one is ready
+		slot = "b" if self.sources == os.path.join(self.worktrees, "a") else "a"
+		folder = os.path.join(self.worktrees, slot)
+		with stage(self.name, "merge", self.path):
+			os.makedirs(self.worktrees, exist_ok = True)
+			checked = self.fetcher.checkout(folder, target, self.logfile)
+		if not checked:
+			self.failed.update({"sync": self.sync, "followtags": self.followtags, "preserve": self.preserve, "worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": self.force, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+			cprint("FAILED", "error")
+			excerpt(self.logfile)
+			return
+		cprint("SUCCESSFUL", "correct")
+		patches = self.patches()
+		if patches:
+			print("     APPLYING " + str(len(patches)) + " PATCHES - ", end = "", flush = True)
+			with stage(self.name, "restore", self.path):
+				broken = self.fetcher.series(folder, patches, self.logfile)
+			if broken:
+				# The worktree is checked out again with the fixed series when retrying
+				self.failed.update({"sync": True, "followtags": self.followtags, "preserve": self.preserve, "worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+				self.build = False
+				cprint("FAILED ON " + broken, "error")
+				excerpt(self.logfile)
+				return
+			cprint("SUCCESSFUL", "correct")
+		# Only now the new revision becomes the one builds use
+		with open(os.path.join(self.worktrees, "current"), "w") as file:
+			file.write(slot)
+		self.changed, self.sources = self.changed or target != previous, folder
+		self.builddir = os.path.join(self.sources, self.subdir) if self.subdir else self.sources
+
+	def isolation(self):
+		# Forced builds without syncing still never run on the project folder, they get a worktree of its current revision
+		print("PREPARING WORKTREE:")
+		print("     READING REVISION - ", end = "", flush = True)
+		self.isolate(gitrefs.head(self.path)[1])
+
+	def patches(self):
+		# Local patches live outside the project so no checkout ever touches them, applied in name order
+		folder = os.path.join(running["workdir"], ".nino-patches", self.name)
+		if self.preserve:
+			# Uncommitted changes on the project folder are kept on the series as local.patch
+			diff = self.fetcher.changes()
+			if diff:
+				os.makedirs(folder, exist_ok = True)
+				with open(os.path.join(folder, "local.patch"), "wb") as file:
+					file.write(diff)
+			elif os.path.isfile(os.path.join(folder, "local.patch")):
+				os.remove(os.path.join(folder, "local.patch"))
+		return self.series()
+
+	def series(self):
+		folder = os.path.join(running["workdir"], ".nino-patches", self.name)
+		if not os.path.isdir(folder):
+			return []
+		return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".patch")]
 
 	def package(self):
-		print("BUILDING PACKAGE:")
+		# Look for outputs stored by a previous identical build of each task before touching anything
+		keys = self.cachekeys()
+		hits = {task: cache.lookup(keys[task]) for task in keys}
+		if keys and all(hits[task] is not None for task in self.tasks):
+			# Everything can be reused so we do not even need to run the entrypoint
+			for task in self.tasks:
+				self.reuse(task, hits[task])
+			self.built = 0
+			return
+
 		# User may provide an entrypoint that must be used as setup script before building
-		if os.path.isfile("nino-entrypoint" + execsuffix):
-			print("     ENTRYPOINT SCRIPT - ", end = "", flush = True)
+		if os.path.isfile(os.path.join(self.sources, "nino-entrypoint" + execsuffix)):
 			# Attempt to do the setup
-			self.built = subprocess.call([execprefix + "nino-entrypoint"], stdout = self.logfile, stderr = subprocess.STDOUT)
+			with stage(self.name, "entrypoint", self.path):
+				self.built = call([execprefix + "nino-entrypoint"], cwd = self.sources, stdout = self.logfile, stderr = subprocess.STDOUT)
 			if self.built != 0:
-				cprint("FAILED", "error")
-				self.failed.update({"subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+				cstatus("     " + self.name + ": ENTRYPOINT SCRIPT", "FAILED", "error")
+				excerpt(self.logfile, "     ")
+				self.failed.update({"worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
 				return
 			else:
-				cprint("SUCCESSFUL", "correct")
+				cstatus("     " + self.name + ": ENTRYPOINT SCRIPT", "SUCCESSFUL", "correct")
 
-		# Setup the JAVA_HOME specified
+		# Builds needing the same dependencies as the last successful one skip the network entirely
+		dependencies = gradlecache.fingerprint(self.builddir) if running["gradlecache"] else None
+		offline = gradlecache.known(self.name, dependencies)
+		command, env = self.gradle()
+		try:
+			# Run all the tasks on a single gradle invocation if enabled, paying for the configuration phase only once
+			if self.batch:
+				# Partial hits are of no use since the invocation has to run anyway
+				start = time.time() - 2
+				with stage(self.name, "task:" + ",".join(self.tasks), self.path):
+					self.built = self.assemble(command, [self.tasks[task]["exec"] for task in self.tasks], env, offline)
+				if self.built != 0:
+					cstatus("     " + self.name + ": GRADLE TASKS " + ", ".join(self.tasks), "FAILED", "error")
+					excerpt(self.logfile, "     ")
+					# There is no telling which task broke the invocation so all of them must be retried
+					self.failed.update({"worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.tasks, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+				else:
+					# Gradle leaves behind metadata for every variant it assembled, use it to tell which outputs belong to each task
+					claimed = {}
+					for task in self.tasks:
+						claimed[task] = [apk for apk in variantoutputs(self.sources, self.builddir, self.tasks[task]["exec"]) if apk not in self.releases]
+						self.releases.update(claimed[task])
+					# Tasks the metadata says nothing about get whatever else the invocation wrote
+					for task in [task for task in self.tasks if not claimed[task]]:
+						claimed[task] = [apk for apk in discover(self.sources, start) if apk not in self.releases]
+						self.releases.update(claimed[task])
+					for task in self.tasks:
+						self.remember(keys.get(task), self.addsignlist(task, claimed[task]))
+					cstatus("     " + self.name + ": GRADLE TASKS " + ", ".join(self.tasks), "SUCCESSFUL", "correct")
+			else:
+				for task in self.tasks:
+					# Skip tasks whose outputs were stored by a previous identical build
+					if hits.get(task) is not None:
+						self.reuse(task, hits[task])
+						self.built = 0
+						continue
+					# Remember when the task started to tell apart its fresh outputs, with some slack for filesystems with coarse timestamps
+					start = time.time() - 2
+					# Attempt the task, we also redirect stderr to stdout to effectively merge them.
+					with stage(self.name, "task:" + task, self.path):
+						self.built = self.assemble(command, [self.tasks[task]["exec"]], env, offline)
+					# If assembling fails we return to tell main
+					if self.built != 0:
+						cstatus("     " + self.name + ": GRADLE TASK " + task, "FAILED", "error")
+						excerpt(self.logfile, "     ")
+						# Save for retry only the failed tasks
+						if "tasks" not in self.failed:
+							self.failed["tasks"] = {}
+						self.failed["tasks"].update({task: self.tasks[task]})
+						self.failed.update({"worktree": self.worktree, "subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.failed["tasks"], "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
+					else:
+						self.remember(keys.get(task), self.updatesignlist(task, start))
+						cstatus("     " + self.name + ": GRADLE TASK " + task, "SUCCESSFUL", "correct")
+		finally:
+			# Let the pool know the daemon is idle again, even if something above raised
+			if self.daemon:
+				pool.release(self.javahome)
+		# Everything the build needed is on the cache now
+		if dependencies and not self.failed:
+			gradlecache.remember(self.name, dependencies)
+
+	def gradle(self):
+		# Every build gets its own environment so concurrent projects can use different JAVA_HOME
+		env = dict(os.environ)
 		if self.javahome:
-			os.environ["JAVA_HOME"] = self.javahome
-		# If project specifies a subdir for building get in there
-		if self.subdir:
-			# Remember where to return later
-			topdir = os.getcwd()
-			os.chdir(self.subdir)
+			env["JAVA_HOME"] = self.javahome
 		# Check if gradle wrapper exists before falling back to system-wide gradle
-		if not os.path.isfile("gradlew" + execsuffix):
-			command = "gradle"
+		if not os.path.isfile(os.path.join(self.builddir, "gradlew" + execsuffix)):
+			command = ["gradle"]
+		else:
+			command = [execprefix + "gradlew" + execsuffix]
+		# The shared gradle home goes first, a daemon has to be stopped with the same environment it was started with
+		cacheflags = gradlecache.flags(env)
+		# Reuse a warm daemon for the JAVA_HOME if enabled, else pay for a cold start on each task
+		if self.daemon:
+			flags = pool.acquire(self.javahome, self.builddir, list(command), env)
 		else:
-			command = execprefix + "gradlew" + execsuffix
+			flags = ["--no-daemon"]
+		# Keep gradle within the cores reserved for it by the scheduler
+		if self.cores:
+			flags.append("--max-workers=" + str(self.cores))
+		command.extend(flags + cacheflags)
+		return command, env
+
+	def assemble(self, command, tasks, env, offline):
+		built = call(command + (["--offline"] if offline else []) + tasks, cwd = self.builddir, env = env, stdout = self.logfile, stderr = subprocess.STDOUT)
+		# Something may be missing from the cache after all, give the network a chance before failing
+		if built != 0 and offline:
+			print("Offline build failed, trying again online", file = self.logfile, flush = True)
+			built = call(command + tasks, cwd = self.builddir, env = env, stdout = self.logfile, stderr = subprocess.STDOUT)
+		return built
+
+	def prefetch(self):
+		# Nothing to download when the dependencies are the same the last successful build used
+		if gradlecache.known(self.name, gradlecache.fingerprint(self.builddir)):
+			return
+		print("     RESOLVING DEPENDENCIES - ", end = "", flush = True)
+		command, env = self.gradle()
+		try:
+			with stage(self.name, "prefetch", self.path):
+				resolved = call(command + ["--init-script", gradlecache.script(), "ninoPrefetch"], cwd = self.builddir, env = env, stdout = self.logfile, stderr = subprocess.STDOUT)
+		finally:
+			if self.daemon:
+				pool.release(self.javahome)
+		# Not fatal, whatever is missing will be downloaded while building
+		if resolved == 0:
+			cprint("SUCCESSFUL", "correct")
+		else:
+			cprint("INCOMPLETE", "warning")
+
+	def state(self):
+		# Worktree builds are identified by what is checked out on the worktree
+		if self.sources != self.path:
+			return git.revision(self.sources)
+		return self.fetcher.revision() if self.fetcher.type else None
+
+	def cachekeys(self):
+		# Builds can only be reused when the exact state of the sources is known
+		revision = self.revision = self.state()
+		if not revision:
+			return {}
+		# Worktrees hold the revision with the patch series on top, which changes the outputs just as much
+		series = None
+		if self.sources != self.path:
+			series = hashlib.sha256()
+			for patch in self.series():
+				with open(patch, "rb") as file:
+					series.update(file.read())
+			series = series.hexdigest()
+		keys = {}
 		for task in self.tasks:
-			print("     GRADLE TASK " + task + " - ", end = "", flush = True)
-			# Attempt the task, we also redirect stderr to stdout to effectively merge them.
-			self.built = subprocess.call([command, "--no-daemon", self.tasks[task]["exec"]], stdout = self.logfile, stderr = subprocess.STDOUT)
-			# If assembling fails we return to tell main
-			if self.built != 0:
-				cprint("FAILED", "error")
-				# Save for retry only the failed tasks
-				if "tasks" not in self.failed:
-					self.failed["tasks"] = {}
-				self.failed["tasks"].update({task: self.tasks[task]})
-				self.failed.update({"subdir": self.subdir, "javahome": self.javahome, "build": self.build, "force": True, "tasks": self.failed["tasks"], "keystore": self.keystore, "keyalias": self.keyalias, "signlist": self.signlist, "deploylist": self.deploylist, "deploy": self.deploy})
-			else:
-				if self.subdir:
-					# Return to previous dir for scanning
-					os.chdir(topdir)
-				self.updatesignlist(task)
-				if self.subdir:
-					# Return to previous dir for scanning
-					os.chdir(self.subdir)
-				cprint("SUCCESSFUL", "correct")
-		if self.subdir:
-			os.chdir(topdir)
-		# Forget JAVA_HOME before the next project
-		if self.javahome:
-			os.environ.pop("JAVA_HOME")
+			keystore = self.tasks[task].get("keystore", self.keystore)
+			keyalias = self.tasks[task].get("keyalias", self.keyalias)
+			# Everything that changes the resulting outputs is part of the key
+			identity = [self.name, revision, self.subdir, self.javahome, self.tasks[task]["exec"], keystore, keyalias, series]
+			if keystore in running["keystores"] and keyalias in running["keystores"][keystore]["aliases"]:
+				identity.extend([running["keystores"][keystore]["path"], running["keystores"][keystore]["aliases"][keyalias]["name"]])
+			keys[task] = hashlib.sha256(json.dumps(identity).encode()).hexdigest()
+		return keys
 
-	def updatesignlist(self, task):
-		# Retrieve all present .apk inside projects folder
-		apks = [str(apk) for apk in pathlib.Path().glob("**/*.apk")]
-		# Filter out those that are not result of a Gradle task
+	def reuse(self, task, artifacts):
+		# Put the stored outputs back on the releases folder as if they were just signed
+		for artifact in artifacts:
+			releases.publish(cache.blob(artifact["blob"]), {"displayname": artifact["displayname"], "project": self.name, "task": task, "revision": self.revision}, artifact["blob"], move = False)
+			self.updatedeploylist(artifact["displayname"], self.targets(task, artifact["split"]))
+		cstatus("     " + self.name + ": GRADLE TASK " + task, "CACHED", "warning")
+
+	def remember(self, key, apks):
+		# A build without outputs is not worth reusing, it would only hide them on the next run
+		if not key or not apks:
+			return
+		# The build is only reusable once all of its outputs are signed and stored
+		cache.expect(key, len(apks))
+		for apk in apks:
+			self.signlist[apk]["cache"] = key
+
+	def targets(self, task, split):
+		# Get deploy targets from task if they exist, else fallback to project, which already fell back to defconfig
+		deploy = self.tasks[task].get("deploy", self.deploy)
+		# Override deploy configuration if specified for the split
+		if split in self.tasks[task].get("splits", []):
+			deploy = self.tasks[task]["splits"][split].get("deploy", deploy)
+		return deploy
+
+	def updatesignlist(self, task, start):
+		# Outputs written since the task started belong to it, as well as those gradle considered up to date for its variant
+		apks = set(discover(self.sources, start)).union(variantoutputs(self.sources, self.builddir, self.tasks[task]["exec"]))
+		# Filter out those already claimed by a previous task
+		new = apks.difference(self.releases)
+		self.releases.update(new)
+		return self.addsignlist(task, new)
+
+	def addsignlist(self, task, apks):
 		validroutes = re.compile(".*build(\\\\|\/).*outputs(\\\\|\/).*apk(\\\\|\/)")
-		# Filter out those remaining from a previous failed task
-		previous = copy.deepcopy(self.releases)
-		self.releases = set(filter(validroutes.match, apks))
-		# Discover which one are the outputs corresponding to the just finished task
-		new = previous.symmetric_difference(self.releases)
 		# Create a dictionary for each route containing apks
 		outputs = {}
 		apkroute = re.compile("[^\\\\|\/]*\.apk")
-		for apk in new:
+		for apk in apks:
 			# Determine the apk full route inside project
 			route = re.sub(apkroute, "", apk)
 			if route not in outputs:
@@ -170,55 +478,115 @@ class project():
 					displayname = self.name + "-" + task + "-" + displayname[0]
 				else:
 					displayname = self.name + "-" + task
-				# Get keystore, keyalias and deploy targets from task if they exist, else fallback to project, which already fell back to defconfig
+				# Get keystore and keyalias from task if they exist, else fallback to project, which already fell back to defconfig
 				keystore = self.tasks[task].get("keystore", self.keystore)
 				keyalias = self.tasks[task].get("keyalias", self.keyalias)
-				deploy = self.tasks[task].get("deploy", self.deploy)
 				# Append split name if required (there's more than one apk in the route)
-				if len(outputs[route]["apks"]) > 1:
-					displayname = displayname + "-" + outputs[route]["splitnames"][index]
-					# Override deploy configuration if specified
-					if outputs[route]["splitnames"][index] in self.tasks[task].get("splits", []):
-						deploy = self.tasks[task]["splits"][outputs[route]["splitnames"][index]].get("deploy", deploy)
+				split = outputs[route]["splitnames"][index] if len(outputs[route]["apks"]) > 1 else ""
+				if split:
+					displayname = displayname + "-" + split
 				# Create a new entry with all the required data to continue the process
 				self.signlist[apk] = {
 					"displayname": displayname + ".apk",
 					"keystore": keystore,
 					"keyalias": keyalias,
-					"deploy": deploy
+					"deploy": self.targets(task, split),
+					"split": split,
+					"task": task
 				}
+		return list(apks)
 
 
 	def sign(self):
 		print("SIGNING OUTPUTS:")
 		# Store the list of failed to sign outpusts and devices to deploy later on a different dict
 		failedsignlist = {}
-		# Loop through the remaining apks (there may be different flavours)
+		# Verify whether is needed or not to sign, as some outputs may come out of building process already signed
+		with stage(self.name, "verify", self.path):
+			signed = {apk: inspect(os.path.join(self.sources, apk))["signed"] for apk in self.signlist}
+		# Unsigned outputs are aligned before signing, signed ones would lose their signature
+		with stage(self.name, "align", self.path):
+			self.align([apk for apk in self.signlist if not signed[apk]])
+		with stage(self.name, "sign", self.path):
+			self.signall(signed, failedsignlist)
+		# If we failed at least on one output we need to save it for the retry run
+		if failedsignlist:
+			self.failed.update({"worktree": self.worktree, "keystore": self.keystore, "keyalias": self.keyalias, "signlist": failedsignlist, "deploylist": self.deploylist, "deploy": self.deploy})
+
+	def align(self, apks):
+		# Only outputs with stored entries out of place are rewritten, every output is reported either way
+		for apk in apks:
+			wrong = realign(os.path.join(self.sources, apk))
+			if wrong is None:
+				# Signing may still work, the signer will tell
+				cstatus("     " + self.signlist[apk]["displayname"], "UNALIGNED", "warning")
+			elif wrong:
+				self.logfile.write(self.signlist[apk]["displayname"] + ": realigned " + ", ".join(wrong) + "\n")
+				cstatus("     " + self.signlist[apk]["displayname"], "REALIGNED " + str(len(wrong)) + " ENTRIES", "warning")
+			else:
+				cstatus("     " + self.signlist[apk]["displayname"], "ALIGNED", "correct")
+
+	def signall(self, signed, failedsignlist):
+		# Hand every output that needs it to the signer of its key, which signs them at the same time
+		results = {}
 		for apk in self.signlist:
-			print("     " + self.signlist[apk]["displayname"] + " - ", end = "", flush = True)
-			# Verify whether is needed or not to sign, as some outputs may come out of building process already signed
-			verify = subprocess.call(["apksigner" + execsuffix, "verify", apk], stdout = self.logfile, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
-			if verify == 1:
-				# Sign the .apk with the provided key
-				sign = subprocess.Popen(["apksigner" + execsuffix, "sign", "--ks", running["keystores"][self.signlist[apk]["keystore"]]["path"], "--ks-key-alias", running["keystores"][self.signlist[apk]["keystore"]]["aliases"][self.signlist[apk]["keyalias"]]["name"],"--out", workdir + "/NINO-RELEASES/" + self.signlist[apk]["displayname"], "--in", apk], stdout = self.logfile, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
-				# Generate the input using the two passwords and feed it to the subprocess
-				secrets = running["keystores"][self.signlist[apk]["keystore"]]["password"] + "\n" + running["keystores"][self.signlist[apk]["keystore"]]["aliases"][self.signlist[apk]["keyalias"]]["password"]
-				sign.communicate(input=secrets.encode())
-				if sign.returncode == 0:
-					# If everything went fine add the new .apk to the list of releases
-					self.updatedeploylist(self.signlist[apk]["displayname"], self.signlist[apk]["deploy"])
-					os.remove(apk)
-					cprint("SUCCESSFUL", "correct")
-				else:
-					failedsignlist[apk] = self.signlist[apk]
-					cprint("FAILED", "error")
+			store, alias = self.signlist[apk]["keystore"], self.signlist[apk]["keyalias"]
+			if signed[apk]:
+				results[apk] = done(("UNNEEDED", ""))
+			# Keys are only checked once something actually needs them, before any status line so prompts stay readable
+			elif not keys.unlock(store, alias):
+				results[apk] = done(("FAILED", "keystore or key could not be unlocked"))
 			else:
+				# Never write over the current release, it only changes once the new one is signed
+				staged = releases.staging(self.signlist[apk]["displayname"])
+				if os.path.lexists(staged):
+					os.remove(staged)
+				signer = signers.signer(store, alias)
+				results[apk] = signer.request(os.path.join(self.sources, apk), staged) if signer else done(self.apksign(apk))
+		# Loop through the remaining apks (there may be different flavours) in order as they finish
+		for apk in self.signlist:
+			status, details = results[apk].result()
+			print("     " + self.signlist[apk]["displayname"] + " - ", end = "", flush = True)
+			if details:
+				self.logfile.write(self.signlist[apk]["displayname"] + ": " + details + "\n")
+			if status == "SIGNED":
+				# If everything went fine add the new .apk to the list of releases
+				self.updatedeploylist(self.signlist[apk]["displayname"], self.signlist[apk]["deploy"])
+				os.remove(os.path.join(self.sources, apk))
+				self.store(apk, self.publish(apk, releases.staging(self.signlist[apk]["displayname"])))
+				cprint("SUCCESSFUL", "correct")
+			elif status == "UNNEEDED":
 				self.updatedeploylist(self.signlist[apk]["displayname"], self.signlist[apk]["deploy"])
-				os.rename(apk, workdir + "/NINO-RELEASES/" + self.signlist[apk]["displayname"])
+				self.store(apk, self.publish(apk, os.path.join(self.sources, apk)))
 				cprint("UNNEEDED", "warning")
-		# If we failed at least on one output we need to save it for the retry run
-		if failedsignlist:
-			self.failed.update({"keystore": self.keystore, "keyalias": self.keyalias, "signlist": failedsignlist, "deploylist": self.deploylist, "deploy": self.deploy})
+			else:
+				# Whatever the signer left behind is of no use
+				if os.path.lexists(releases.staging(self.signlist[apk]["displayname"])):
+					os.remove(releases.staging(self.signlist[apk]["displayname"]))
+				failedsignlist[apk] = self.signlist[apk]
+				cprint("FAILED", "error")
+				excerpt(self.logfile)
+
+	def apksign(self, apk):
+		keystore = running["keystores"][self.signlist[apk]["keystore"]]
+		key = keystore["aliases"][self.signlist[apk]["keyalias"]]
+		# Sign the .apk with the provided key
+		sign = Popen(["apksigner" + execsuffix, "sign", "--ks", keystore["path"], "--ks-key-alias", key["name"],"--out", releases.staging(self.signlist[apk]["displayname"]), "--in", os.path.join(self.sources, apk)], stdout = self.logfile, stdin=subprocess.PIPE, stderr=subprocess.STDOUT)
+		# Generate the input using the two passwords and feed it to the subprocess
+		secrets = keystore["password"] + "\n" + key["password"]
+		sign.communicate(input=secrets.encode())
+		return ("SIGNED" if sign.returncode == 0 else "FAILED", "")
+
+	def publish(self, apk, path):
+		# Move the final output into the release store, remembering where it came from
+		if self.revision is None:
+			self.revision = self.state()
+		return releases.publish(path, {"displayname": self.signlist[apk]["displayname"], "project": self.name, "task": self.signlist[apk].get("task", ""), "revision": self.revision})
+
+	def store(self, apk, digest):
+		# Keep the final output around in case an identical build is requested later
+		if "cache" in self.signlist[apk]:
+			cache.store(self.signlist[apk]["cache"], {"displayname": self.signlist[apk]["displayname"], "split": self.signlist[apk].get("split", "")}, releases.blob(digest), digest)
 
 	def updatedeploylist(self, apk, targets):
 		devices = set()
@@ -228,6 +596,63 @@ class project():
 
 	def install(self):
 		print("DEPLOYING OUTPUTS:")
+		# Devices are only looked up once per run, anything not attached by then fails right away
+		online = devices.online(refresh = running["rescan"])
+		# Read package, version, split name and signer of each output
+		identities = {apk: identity(running["workdir"] + "/NINO-RELEASES/" + apk) for apk in self.deploylist if self.deploylist[apk]}
+		# Outputs of the same package and version where some of them are split apks form a bundle that must be installed together
+		bundles = {}
+		for apk in [apk for apk in identities if identities[apk]]:
+			bundles.setdefault((identities[apk]["package"], identities[apk]["versionCode"]), []).append(apk)
+		bundles = {apk: key for key in bundles if any(identities[member]["split"] for member in bundles[key]) for apk in bundles[key]}
+		# Queue the outputs for each device so they are installed in order while other devices work at the same time, each bundle as a single entry
+		queues, queued = {}, {}
+		for apk in self.deploylist:
+			for target in self.deploylist[apk]:
+				if apk in bundles and (target, bundles[apk]) in queued:
+					queued[(target, bundles[apk])].append(apk)
+					continue
+				queues.setdefault(target, []).append([apk])
+				if apk in bundles:
+					queued[(target, bundles[apk])] = queues[target][-1]
+		results = {}
+		# Devices are installed to at the same time so each one writes on its own log
+		logs = {target: logstream(self.name, self.path, "install:" + target, self.logfile) for target in queues}
+		def deploy(target):
+			with stage(self.name, "install:" + target, self.path):
+				transfer(target)
+		def transfer(target):
+			for unit in queues[target]:
+				if target not in online:
+					print("Device " + target + " not reachable for " + ", ".join(unit), file = logs[target], flush = True)
+					results.update({(apk, target): False for apk in unit})
+					continue
+				# Skip whatever the device already has if enabled
+				if running["dedup"] and all(identities.get(apk) and devices.current(target, identities[apk]) for apk in unit):
+					results.update({(apk, target): None for apk in unit})
+					continue
+				if unit[0] in bundles:
+					# Bundles go on a single transaction, streamed right into the package manager when possible
+					command = ["adb", "-s", target, "install-multiple", "-r"]
+					if devices.streaming(target):
+						command.append("--streaming")
+					# Without the base apk the splits are added to the package already installed
+					if all(identities[apk]["split"] for apk in unit):
+						command.extend(["-p", identities[unit[0]]["package"]])
+				else:
+					# We send the apk trying to override it on the system if neccessary
+					command = ["adb", "-s" , target, "install", "-r"]
+				send = call(command + [running["workdir"] + "/NINO-RELEASES/" + apk for apk in unit], stdout = logs[target], stderr=subprocess.STDOUT)
+				# A failed transaction only affects this device
+				results.update({(apk, target): send == 0 for apk in unit})
+				if send == 0:
+					for apk in [apk for apk in unit if identities.get(apk)]:
+						devices.record(target, identities[apk])
+		with concurrent.futures.ThreadPoolExecutor(max_workers = running["deployjobs"]) as executor:
+			list(executor.map(deploy, queues))
+		for target in logs:
+			logs[target].close()
+		devices.save()
 		# Store the list of failed to deploy outputs and devices on a different dict
 		faileddeploylist = {}
 		for apk in self.deploylist:
@@ -240,25 +665,19 @@ class project():
 				print()
 			faileddeploylist[apk] = []
 			for target in self.deploylist[apk]:
-				print("          TO DEVICE " + target + " - ", end = "\r")
-				try:
-					# Make sure the device is online before proceeding, timeout after 15 secs of waiting
-					cprint("          TO DEVICE " + target + " CONNECTING   ", "warning", "\r")
-					subprocess.call(["adb", "-s", target, "wait-for-device"], timeout = 15, stdout = self.logfile, stderr = subprocess.STDOUT)
-				# If the adb subprocess timed out we skip this device
-				except subprocess.TimeoutExpired:
+				if target not in online:
 					faileddeploylist[apk].append(target)
 					cprint("          TO DEVICE " + target + " NOT REACHABLE", "error")
-					print("Not reachable", file = self.logfile, flush = True)
+				elif results[(apk, target)] is None:
+					cprint("          TO DEVICE " + target + " ALREADY INSTALLED", "warning")
+				elif results[(apk, target)]:
+					cprint("          TO DEVICE " + target + " SUCCESSFUL", "correct")
 				else:
-					cprint("          TO DEVICE " + target + " DEPLOYING    ", "warning", "\r")
-					# We send the apk trying to override it on the system if neccessary
-					send = subprocess.call(["adb", "-s" , target, "install", "-r", workdir + "/NINO-RELEASES/" + apk], stdout = self.logfile, stderr=subprocess.STDOUT)
-					if send == 0:
-						cprint("          TO DEVICE " + target + " SUCCESSFUL   ", "correct")
-					else:
-						faileddeploylist[apk].append(target)
-						cprint("          TO DEVICE " + target + " FAILED       ", "error")
+					faileddeploylist[apk].append(target)
+					cprint("          TO DEVICE " + target + " FAILED", "error")
+					# The log of a device tells about every output sent to it, show it only once
+					if target in logs:
+						excerpt(logs.pop(target), "               ")
 			if len(faileddeploylist[apk]) < 1:
 				faileddeploylist.pop(apk)
 		# We need to retry if at least one output wasn't delivered
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import threading
+from .config import running
+from .cache import filehash, place
+
+class releasestore():
+	def __init__(self):
+		self.root = None
+		self.entries = None
+		self.lock = threading.Lock()
+
+	def load(self):
+		# The index belongs to the releases folder of the current working directory
+		root = os.path.join(running["workdir"], "NINO-RELEASES", ".store")
+		if self.entries is None or self.root != root:
+			self.root = root
+			try:
+				with open(os.path.join(self.root, "index.json"), "r") as file:
+					self.entries = json.load(file)
+			except (OSError, ValueError):
+				self.entries = {}
+		return self.entries
+
+	def blob(self, digest):
+		return os.path.join(self.root, "blobs", digest + ".apk")
+
+	def staging(self, displayname):
+		# Signers write here first, so the current release stays in place if signing fails
+		folder = os.path.join(running["workdir"], "NINO-RELEASES", ".store", "staging")
+		os.makedirs(folder, exist_ok = True)
+		return os.path.join(folder, displayname)
+
+	def publish(self, source, record, digest = None, move = True):
+		# Outputs are stored by their contents and the displayname only points to the current one
+		digest = digest or filehash(source)
+		target = os.path.join(running["workdir"], "NINO-RELEASES", record["displayname"])
+		with self.lock:
+			history = self.load().setdefault(record["displayname"], [])
+			if not os.path.isfile(self.blob(digest)):
+				os.makedirs(os.path.join(self.root, "blobs"), exist_ok = True)
+				if move:
+					os.replace(source, self.blob(digest))
+				else:
+					place(source, self.blob(digest))
+			# Identical bytes were already stored so the new copy is not needed at all
+			elif move:
+				os.remove(source)
+			link(self.blob(digest), target)
+			# Publishing the same bytes again only refreshes the current release
+			if history and history[-1]["blob"] == digest:
+				history[-1].update(record, signed = round(time.time(), 3))
+			else:
+				history.append(dict(record, blob = digest, signed = round(time.time(), 3)))
+		return digest
+
+	def save(self):
+		if self.entries is None:
+			return
+		# Keep the last releases of every output, the current one is never evicted
+		for displayname in self.entries:
+			self.entries[displayname] = self.entries[displayname][-max(running["releasekeep"], 1):]
+		# Then drop the oldest releases that are not current until everything fits on the size limit
+		if running["releasesize"]:
+			sizes = {}
+			for name in set(entry["blob"] for history in self.entries.values() for entry in history):
+				sizes[name] = os.path.getsize(self.blob(name)) if os.path.isfile(self.blob(name)) else 0
+			older = sorted(((entry["signed"], displayname, entry) for displayname, history in self.entries.items() for entry in history[:-1]), key = lambda item: item[0])
+			total = sum(sizes.values())
+			for signed, displayname, entry in older:
+				if total <= running["releasesize"] * 1048576:
+					break
+				self.entries[displayname].remove(entry)
+				# Blobs are shared, they only free space once nothing references them anymore
+				if not any(other["blob"] == entry["blob"] for history in self.entries.values() for other in history):
+					total -= sizes[entry["blob"]]
+		# Forget about the blobs no release references anymore
+		referenced = set(entry["blob"] + ".apk" for history in self.entries.values() for entry in history)
+		if os.path.isdir(os.path.join(self.root, "blobs")):
+			for name in os.listdir(os.path.join(self.root, "blobs")):
+				if name not in referenced:
+					os.remove(os.path.join(self.root, "blobs", name))
+		os.makedirs(self.root, exist_ok = True)
+		with open(os.path.join(self.root, "index.json"), "w") as file:
+			json.dump(self.entries, file, indent = '\t')
+
+def link(blob, target):
+	if os.path.lexists(target):
+		os.remove(target)
+	# Relative links keep working if the whole working directory is moved around
+	try:
+		os.symlink(os.path.relpath(blob, os.path.dirname(target)), target)
+	except (OSError, NotImplementedError):
+		# Hard links or copies work wherever symbolic links are not allowed, like Windows without privileges
+		place(blob, target)
+
+def listing(workdir):
+	# Releases of every output, newest first, straight from the index
+	try:
+		with open(os.path.join(workdir, "NINO-RELEASES", ".store", "index.json"), "r") as file:
+			entries = json.load(file)
+	except (OSError, ValueError):
+		print("No releases were recorded yet on " + workdir)
+		return
+	for displayname in sorted(entries):
+		print(displayname + ":")
+		for index, entry in enumerate(reversed(entries[displayname])):
+			print("     " + time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["signed"])) + " - " + entry["blob"][:12] + " - " + entry["project"] + "/" + entry["task"] + " at " + (entry["revision"] or "unknown revision")[:12] + (" (current)" if index == 0 else ""))
+
+# Signers publish through the same index one at a time
+releases = releasestore()
@@ -0,0 +1,94 @@
+import os
+import threading
+from .utils import cprint
+
+def freememory():
+	# Memory available for new processes in MiB, read from the kernel when possible
+	try:
+		with open("/proc/meminfo", "r") as file:
+			for line in file:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) // 1024
+	except OSError:
+		pass
+	try:
+		return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 1048576
+	except (ValueError, OSError, AttributeError):
+		# Without a way to know we do not limit by memory at all
+		return float("inf")
+
+class scheduler():
+	def __init__(self, jobs, task = None, priority = None):
+		self.jobs = max(jobs, 1)
+		# Budgets that running builds reserve from while they last
+		self.cores = os.cpu_count() or 1
+		self.memory = freememory()
+		self.used = {"jobs": 0, "cores": 0, "memory": 0}
+		self.condition = threading.Condition()
+		# What to do with each project and which ones go first when several are waiting
+		self.task = task or (lambda app: app.package())
+		self.priority = priority or (lambda app: 0)
+		self.pending, self.threads, self.closed = [], [], False
+		self.dispatcher = threading.Thread(target = self.dispatch)
+
+	def cost(self, app):
+		# Projects without explicit requirements reserve a single core and no memory
+		return max(app.cores or 1, 1), app.memory or 0
+
+	def fits(self, app):
+		cores, memory = self.cost(app)
+		# A build larger than the whole host still runs, but never next to another one
+		if self.used["jobs"] == 0:
+			return True
+		return self.used["jobs"] < self.jobs and self.used["cores"] + cores <= self.cores and self.used["memory"] + memory <= self.memory
+
+	def reserve(self, app, amount):
+		cores, memory = self.cost(app)
+		self.used["jobs"] += amount
+		self.used["cores"] += amount * cores
+		self.used["memory"] += amount * memory
+
+	def work(self, app, task):
+		try:
+			task(app)
+		except Exception as error:
+			# Never let a crashing build keep its slots forever
+			cprint("     " + app.name + ": " + str(error), "error")
+		finally:
+			with self.condition:
+				self.reserve(app, -1)
+				self.condition.notify_all()
+
+	def start(self):
+		self.dispatcher.start()
+
+	def submit(self, app, task = None):
+		# Projects may keep arriving while others are already building, and other jobs of the same cost share the budget with builds
+		with self.condition:
+			self.pending.append((app, task or self.task))
+			self.pending.sort(key = lambda job: self.priority(job[0]))
+			self.condition.notify_all()
+
+	def close(self):
+		# No more projects will come, wait for the ones we have
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+		self.dispatcher.join()
+		for thread in self.threads:
+			thread.join()
+
+	def dispatch(self):
+		with self.condition:
+			# Running jobs may still queue a follow up even after closing
+			while self.pending or self.used["jobs"] or not self.closed:
+				# Start the first queued project that fits on the free slots, letting smaller ones overtake a big one that has to wait
+				ready = [job for job in self.pending if self.fits(job[0])]
+				if not ready:
+					self.condition.wait()
+					continue
+				self.pending.remove(ready[0])
+				self.reserve(ready[0][0], 1)
+				thread = threading.Thread(target = self.work, args = ready[0])
+				thread.start()
+				self.threads.append(thread)
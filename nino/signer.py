@@ -0,0 +1,114 @@
+import os
+import shutil
+import threading
+import subprocess
+import concurrent.futures
+from .config import running
+from .statics import execsuffix
+from .metrics import Popen
+
+def library():
+	# The apksigner launcher of the build tools runs lib/apksigner.jar next to it, we want the jar itself
+	launcher = shutil.which("apksigner" + execsuffix)
+	if not launcher or not shutil.which("java"):
+		return None
+	jar = os.path.join(os.path.dirname(os.path.realpath(launcher)), "lib", "apksigner.jar")
+	return jar if os.path.isfile(jar) else None
+
+class signservice():
+	def __init__(self, arguments, secrets = None):
+		self.arguments = arguments
+		self.secrets = secrets
+		self.process = None
+		self.pending = {}
+		self.counter = 0
+		self.lock = threading.Lock()
+
+	def start(self, jar):
+		try:
+			self.process = Popen(["java", "-cp", jar, os.path.join(os.path.dirname(__file__), "NinoSigner.java")] + self.arguments, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, text = True, bufsize = 1)
+			# Passwords only travel through the pipe, never on the command line nor the environment
+			if self.secrets:
+				self.process.stdin.write(self.secrets + "\n")
+				self.process.stdin.flush()
+			ready = self.process.stdout.readline()
+		except OSError:
+			return False
+		finally:
+			self.secrets = None
+		if not ready.startswith("READY"):
+			self.stop()
+			return False
+		threading.Thread(target = self.collect, daemon = True).start()
+		return True
+
+	def collect(self):
+		# Answers come back in whatever order the signer finishes them
+		for line in self.process.stdout:
+			fields = line.rstrip("\n").split("\t")
+			with self.lock:
+				future = self.pending.pop(fields[0], None)
+			if future:
+				future.set_result((fields[1], fields[2] if len(fields) > 2 else ""))
+		# The signer is gone, nothing else will be answered
+		with self.lock:
+			pending, self.pending = self.pending, {}
+		for future in pending.values():
+			future.set_result(("FAILED", "signer exited"))
+
+	def request(self, *paths):
+		future = concurrent.futures.Future()
+		with self.lock:
+			self.counter += 1
+			self.pending[str(self.counter)] = future
+			try:
+				self.process.stdin.write("\t".join([str(self.counter)] + list(paths)) + "\n")
+				self.process.stdin.flush()
+			except (OSError, ValueError):
+				self.pending.pop(str(self.counter))
+				future.set_result(("FAILED", "signer exited"))
+		return future
+
+	def stop(self):
+		try:
+			self.process.stdin.close()
+		except OSError:
+			pass
+		try:
+			self.process.wait(timeout = 60)
+		except subprocess.TimeoutExpired:
+			self.process.kill()
+
+class signerpool():
+	def __init__(self):
+		# Started services by key, None when it could not be started so we do not try again
+		self.services = {}
+		self.lock = threading.Lock()
+
+	def service(self, key, arguments, secrets = None):
+		with self.lock:
+			if key not in self.services:
+				jar = library()
+				service = signservice(arguments, secrets)
+				self.services[key] = service if jar and service.start(jar) else None
+			return self.services[key]
+
+	def signer(self, store, alias):
+		keystore = running["keystores"][store]
+		return self.service((store, alias), [keystore["path"], keystore["aliases"][alias]["name"], str(os.cpu_count() or 1)], keystore["password"] + "\n" + keystore["aliases"][alias]["password"])
+
+	def stopall(self):
+		with self.lock:
+			services, self.services = self.services, {}
+		for service in services.values():
+			if service:
+				service.stop()
+
+# Signing services stay up between projects, each key only pays for starting a JVM once
+signers = signerpool()
+
+def done(result):
+	# Wrap results obtained without the service so callers handle both the same way
+	future = concurrent.futures.Future()
+	future.set_result(result)
+	return future
@@ -1,8 +1,5 @@
-import os
 import platform
 
-projects = [name for name in os.listdir() if os.path.isdir(name) and name != "NINO-RELEASES"]
-workdir = os.getcwd()
 execprefix = "" if "Windows" in platform.system() else "./"
 execsuffix = ".bat" if "Windows" in platform.system() else ""
 ansiescape = {
@@ -19,16 +16,23 @@ dependencies = {
 	"keytool": "https://java.com/en/download/manual.jsp",
 	"git": "https://git-scm.com/book/en/v2/Getting-Started-Installing-Git",
 	"gradle": "https://gradle.org/install/",
-	"zipalign": "https://developer.android.com/studio/#downloads (build-tools)",
 	"apksigner": "https://developer.android.com/studio/#downloads (build-tools)",
 	"adb": "https://developer.android.com/studio/#downloads (platform-tools)"
 }
 defconfig = {
 	"sync": False,
 	"followtags": True,
+	"tagpattern": False,
 	"preserve": False,
+	"worktree": False,
+	"shared": False,
+	"partial": False,
+	"depth": False,
+	"maintenance": False,
 	"build": False,
 	"javahome": False,
+	"daemon": False,
+	"batch": False,
 	"tasks": {
 		"release": {
 			"exec": "assembleRelease"
@@ -37,5 +41,23 @@ defconfig = {
 	"keystore": False,
 	"keyalias": False,
 	"deploy": [],
-	"subdir": ""
+	"subdir": "",
+	"cores": False,
+	"memory": False,
+	"interval": 3600
 	}
+# Which part of the run each measured stage belongs to
+stagekinds = {
+	"fetch": "sync",
+	"merge": "sync",
+	"restore": "sync",
+	"maintain": "sync",
+	"prefetch": "build",
+	"entrypoint": "build",
+	"task": "build",
+	"verify": "sign",
+	"align": "sign",
+	"sign": "sign",
+	"signer": "sign",
+	"install": "deploy"
+}
@@ -1,6 +1,6 @@
-import sys
 import shutil
 from .statics import fetchmethods, dependencies, ansiescape
+from .config import ninoerror
 
 def dpnds():
 	ready = True
@@ -8,12 +8,16 @@ def dpnds():
 		if not shutil.which(dep):
 			# Do not consider missing fetchmethods a critical failure and just disable them
 			if dep in ["git"]:
-				fetchmethods.pop("." + dep)
+				fetchmethods.pop("." + dep, None)
 			else:
 				ready = False
 			print("The required dependency '" + dep + "' is not in your PATH. Please refer to " + dependencies[dep])
 	if not ready:
-		sys.exit(1)
+		raise ninoerror("Missing required dependencies, halting")
 
 def cprint(msg, color, end = "\n"):
     print(ansiescape[color] + msg + ansiescape["close"], end = end)
+
+def cstatus(msg, status, color):
+    # Write the whole line at once so output from concurrent projects never interleaves mid-line
+    print(msg + " - " + ansiescape[color] + status + ansiescape["close"] + "\n", end = "", flush = True)
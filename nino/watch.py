@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import queue
+import socket
+import threading
+import socketserver
+from .config import running, retryconfig, projects, ninoerror
+from .utils import cprint
+
+class controlhandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		# A single line with the command and the projects it applies to, answered with a single line
+		words = self.rfile.readline().decode("utf-8", "ignore").split()
+		self.wfile.write((self.server.watcher.command(words) + "\n").encode())
+
+class watcher():
+	def __init__(self, cycle):
+		# Runs the given projects from start to end, forcing or retrying some of them
+		self.cycle = cycle
+		# Triggers from the control socket wait here until the current run is over
+		self.jobs = queue.Queue()
+		self.due = {}
+		self.busy = []
+		self.server = None
+		self.address = os.path.join(running["workdir"], ".nino-control")
+
+	def interval(self, name):
+		# Seconds between polls of the project, zero means it only runs when triggered
+		seconds = running["projects"].get(name, {}).get("interval", running["projects"]["default"]["interval"])
+		return seconds if seconds else float("inf")
+
+	def command(self, words):
+		if not words:
+			return "empty command"
+		action, names = words[0], words[1:]
+		unknown = [name for name in names if name not in projects]
+		if unknown:
+			return "unknown projects: " + ", ".join(unknown)
+		if action == "status":
+			now = time.time()
+			lines = ["running " + (", ".join(self.busy) if self.busy else "nothing")]
+			for name in projects:
+				lines.append(name + ": " + ("never polled" if self.due[name] == float("inf") else "next poll in " + str(max(int(self.due[name] - now), 0)) + "s") + (", set for retry" if name in retryconfig else ""))
+			# Replies are a single line so the client can simply read until the end
+			return " | ".join(lines)
+		if action not in ["force", "retry", "poll", "stop"]:
+			return "unknown command " + action
+		# Retrying without names means every project that failed
+		if action == "retry" and not names:
+			names = [name for name in projects if name in retryconfig]
+		elif action in ["force", "poll"] and not names:
+			names = list(projects)
+		self.jobs.put((action, names))
+		return "queued " + action + (" " + ", ".join(names) if names else "")
+
+	def listen(self):
+		# Local unix socket where available, a port on the loopback interface otherwise
+		if hasattr(socketserver, "ThreadingUnixStreamServer"):
+			if os.path.exists(self.address):
+				os.remove(self.address)
+			try:
+				self.server = socketserver.ThreadingUnixStreamServer(self.address, controlhandler)
+				os.chmod(self.address, 0o600)
+			except OSError:
+				self.server = None
+		if self.server is None:
+			self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), controlhandler)
+			# Clients find the port on the same file the unix socket would have been
+			with open(self.address, "w") as file:
+				file.write(str(self.server.server_address[1]))
+		self.server.watcher = self
+		threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+	def run(self):
+		# Everything is polled once on start, from then on each project on its own interval
+		self.due = {name: time.time() for name in projects}
+		self.listen()
+		print("------------------------------------------")
+		print("WATCHING " + str(len(projects)) + " PROJECTS, CONTROL ON " + self.address)
+		try:
+			while True:
+				# Sleep until the next project is due or something is triggered
+				wait = min(self.due.values(), default = float("inf")) - time.time()
+				jobs = []
+				try:
+					jobs.append(self.jobs.get(timeout = min(max(wait, 0), 3600)))
+					while True:
+						jobs.append(self.jobs.get_nowait())
+				except queue.Empty:
+					pass
+				if "stop" in [action for action, names in jobs]:
+					break
+				forced = set(name for action, names in jobs if action == "force" for name in names)
+				retried = set(name for action, names in jobs if action == "retry" for name in names)
+				polled = set(name for action, names in jobs if action == "poll" for name in names)
+				now = time.time()
+				polled.update(name for name in self.due if self.due[name] <= now)
+				selected = [name for name in projects if name in forced or name in retried or name in polled]
+				if not selected:
+					continue
+				# Anything that runs counts as polled
+				for name in selected:
+					self.due[name] = now + self.interval(name)
+				self.busy = selected
+				try:
+					self.cycle(selected, forced, retried)
+				except Exception as error:
+					# A broken run must never take the daemon down
+					cprint("Run failed: " + str(error), "error")
+				finally:
+					self.busy = []
+				# Projects forced from the command line are only forced on the first run
+				running["force"] = []
+				sys.stdout.flush()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.server.shutdown()
+			self.server.server_close()
+			if os.path.exists(self.address):
+				os.remove(self.address)
+		print("------------------------------------------")
+		print("STOPPED WATCHING")
+
+def control(workdir, words):
+	# Talk to the daemon running on the working directory
+	address = os.path.join(workdir, ".nino-control")
+	try:
+		if os.path.isfile(address):
+			with open(address, "r") as file:
+				client = socket.create_connection(("127.0.0.1", int(file.read().strip())), timeout = 10)
+		else:
+			client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			client.settimeout(10)
+			client.connect(address)
+		with client:
+			client.sendall((" ".join(words) + "\n").encode())
+			reply = client.makefile("r").readline().strip()
+	except (OSError, ValueError, AttributeError):
+		raise ninoerror("No nino daemon is running on " + workdir)
+	for line in reply.split(" | "):
+		print(line)
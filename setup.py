@@ -12,6 +12,9 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     packages = ['nino'],
+    package_data = {
+        'nino': ['NinoSigner.java']
+    },
     entry_points = {
         'console_scripts': [
             'nino=nino:main'
@@ -0,0 +1,173 @@
+import io
+import struct
+import hashlib
+import zipfile
+import pytest
+from nino.apk import inspect, identity, signaturehash, archive as mapped, misaligned, realign, VERSIONCODE, PADDING
+
+# Stand-in for a X.509 certificate, only its bytes matter to the inspector
+CERTIFICATE = bytes.fromhex("3082000a") + b"nino-test!"
+
+def binaryxml(package, version):
+	# Smallest binary AndroidManifest.xml with a <manifest> element holding the package and versionCode
+	names = ["versionCode", "package", package, "manifest"]
+	encoded = b"".join(bytes([len(name), len(name)]) + name.encode() + b"\0" for name in names)
+	offsets, position = b"", 0
+	for name in names:
+		offsets += struct.pack("<I", position)
+		position += len(name) + 3
+	encoded += b"\0" * (-len(encoded) % 4)
+	pool = struct.pack("<HHIIIIII", 0x0001, 28, 28 + len(offsets) + len(encoded), len(names), 0, 0x100, 28 + len(offsets), 0) + offsets + encoded
+	resources = struct.pack("<HHII", 0x0180, 8, 12, VERSIONCODE)
+	attributes = struct.pack("<IIiHBBI", 0xffffffff, 0, -1, 8, 0, 0x10, version) + struct.pack("<IIiHBBI", 0xffffffff, 1, 2, 8, 0, 0x03, 2)
+	element = struct.pack("<HHIIIIIHHHHHH", 0x0102, 16, 36 + len(attributes), 1, 0xffffffff, 0xffffffff, 3, 20, 20, 2, 0, 0, 0) + attributes
+	body = pool + resources + element
+	return struct.pack("<HHI", 0x0003, 8, 8 + len(body)) + body
+
+def tlv(tag, content, indefinite = False):
+	# DER element, or BER with an indefinite length like jarsigner writes
+	if indefinite:
+		return bytes([tag, 0x80]) + content + b"\0\0"
+	length = len(content)
+	if length < 0x80:
+		return bytes([tag, length]) + content
+	size = (length.bit_length() + 7) // 8
+	return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + content
+
+def pkcs7(indefinite = False):
+	# ContentInfo holding a SignedData with a single certificate
+	signeddata = tlv(0x30, tlv(0x02, b"\x01") + tlv(0x31, b"") + tlv(0x30, tlv(0x06, bytes.fromhex("2a864886f70d010701")), indefinite) + tlv(0xa0, CERTIFICATE, indefinite) + tlv(0x31, b""), indefinite)
+	return tlv(0x30, tlv(0x06, bytes.fromhex("2a864886f70d010702")) + tlv(0xa0, signeddata, indefinite), indefinite)
+
+def archive(path, files, compression = zipfile.ZIP_STORED, comment = b""):
+	with zipfile.ZipFile(path, "w") as apk:
+		apk.writestr("AndroidManifest.xml", binaryxml("org.nino.test", 42), compression)
+		apk.writestr("classes.dex", b"dex\n035\0" * 64, zipfile.ZIP_DEFLATED)
+		for name, content in files.items():
+			apk.writestr(name, content)
+		apk.comment = comment
+	return path
+
+def prefixed(value):
+	return struct.pack("<I", len(value)) + value
+
+def signingblock(path, identifier):
+	# Put an APK Signing Block with a single signer right before the central directory
+	with open(path, "rb") as file:
+		data = file.read()
+	end = data.rfind(b"PK\x05\x06")
+	start = struct.unpack_from("<I", data, end + 16)[0]
+	signed = prefixed(b"") + prefixed(prefixed(CERTIFICATE))
+	value = prefixed(prefixed(prefixed(signed)))
+	pairs = struct.pack("<QI", len(value) + 4, identifier) + value
+	block = struct.pack("<Q", len(pairs) + 24) + pairs + struct.pack("<Q", len(pairs) + 24) + b"APK Sig Block 42"
+	data = data[:start] + block + data[start:end + 16] + struct.pack("<I", start + len(block)) + data[end + 20:]
+	with open(path, "wb") as file:
+		file.write(data)
+	return path
+
+def test_unsigned(tmp_path):
+	path = archive(str(tmp_path / "unsigned.apk"), {})
+	assert inspect(path) == {"signed": False, "scheme": None, "digest": None}
+	assert identity(path) == {"package": "org.nino.test", "versionCode": 42, "split": None, "signature": None}
+
+@pytest.mark.parametrize("indefinite", [False, True])
+def test_v1(tmp_path, indefinite):
+	path = archive(str(tmp_path / "v1.apk"), {"META-INF/MANIFEST.MF": b"Manifest-Version: 1.0\r\n", "META-INF/CERT.SF": b"Signature-Version: 1.0\r\n", "META-INF/CERT.RSA": pkcs7(indefinite)})
+	assert inspect(path) == {"signed": True, "scheme": "v1", "digest": hashlib.sha256(CERTIFICATE).hexdigest()}
+	assert identity(path)["signature"] == signaturehash(CERTIFICATE)
+
+def test_v1_broken_signature(tmp_path):
+	# A signature block that can not be parsed still tells the output is signed, but never raises
+	signature = pkcs7(True)
+	# Cut right after the start of a certificate with an indefinite length that never ends
+	signature = signature[:signature.index(CERTIFICATE)] + b"\x30\x80\x04\x02ab"
+	path = archive(str(tmp_path / "broken.apk"), {"META-INF/MANIFEST.MF": b"", "META-INF/CERT.SF": b"", "META-INF/CERT.RSA": signature})
+	assert inspect(path) == {"signed": True, "scheme": "v1", "digest": None}
+	assert identity(path)["signature"] is None
+
+@pytest.mark.parametrize("identifier, scheme", [(0x7109871a, "v2"), (0xf05368c0, "v3")])
+def test_signing_block(tmp_path, identifier, scheme):
+	path = signingblock(archive(str(tmp_path / "signed.apk"), {}), identifier)
+	with zipfile.ZipFile(path) as apk:
+		assert apk.testzip() is None
+	assert inspect(path) == {"signed": True, "scheme": scheme, "digest": hashlib.sha256(CERTIFICATE).hexdigest()}
+	assert identity(path) == {"package": "org.nino.test", "versionCode": 42, "split": None, "signature": signaturehash(CERTIFICATE)}
+
+def test_deflated_manifest(tmp_path):
+	path = archive(str(tmp_path / "deflated.apk"), {}, compression = zipfile.ZIP_DEFLATED)
+	assert identity(path)["package"] == "org.nino.test"
+
+def test_trailing_comment(tmp_path):
+	# The end of central directory has to be searched backwards past the comment
+	path = signingblock(archive(str(tmp_path / "comment.apk"), {}, comment = b"PK built by nino " * 100), 0x7109871a)
+	assert inspect(path)["scheme"] == "v2"
+	assert identity(path)["versionCode"] == 42
+
+def test_not_an_apk(tmp_path):
+	path = tmp_path / "garbage.apk"
+	path.write_bytes(b"definitely not a zip" * 10)
+	assert inspect(str(path)) == {"signed": False, "scheme": None, "digest": None}
+	assert identity(str(path)) is None
+
+class pipe(io.RawIOBase):
+	# Unseekable target, zipfile then writes the sizes of every entry after its data
+	def __init__(self, path):
+		self.file = open(path, "wb")
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		return self.file.write(data)
+
+	def close(self):
+		self.file.close()
+		super().close()
+
+def unaligned(path, entries, stream = False, comment = b""):
+	# Stored entries land wherever the previous ones ended, as zipfile knows nothing about alignment
+	target = pipe(path) if stream else path
+	with zipfile.ZipFile(target, "w") as apk:
+		apk.writestr("AndroidManifest.xml", binaryxml("org.nino.test", 42), zipfile.ZIP_DEFLATED)
+		for entry, content in entries:
+			apk.writestr(entry, content, zipfile.ZIP_STORED)
+		apk.comment = comment
+	if stream:
+		target.close()
+	return path
+
+def contents(path):
+	with zipfile.ZipFile(path) as apk:
+		return {entry.filename: apk.read(entry) for entry in apk.infolist()}
+
+def previous(name, padding):
+	# Entry left by an earlier alignment, with an unrelated extra field before the now wrong padding
+	entry = zipfile.ZipInfo(name, (2024, 1, 1, 0, 0, 0))
+	entry.extra = struct.pack("<HH4s", 0xcafe, 4, b"nino") + struct.pack("<HHH", PADDING, 2 + padding, 4) + b"\0" * padding
+	return entry
+
+@pytest.mark.parametrize("entries, stream, comment", [
+	([("a.bin", b"a" * 7), ("resources.arsc", b"r" * 333)], False, b""),
+	([("lib/arm64-v8a/libnino.so", b"\x7fELF" * 1000), ("lib/x86_64/libnino.so", b"\x7fELF" * 100)], False, b""),
+	([("a.bin", b"a" * 7), ("lib/arm64-v8a/libnino.so", b"\x7fELF" * 1000)], True, b""),
+	([("a.bin", b"a" * 7), ("resources.arsc", b"r" * 333)], False, b"PK built by nino " * 10),
+	([(previous("a.bin", 1), b"a" * 7), (previous("resources.arsc", 3), b"r" * 333)], False, b"")
+], ids = ["stored", "libraries", "descriptor", "comment", "padded"])
+def test_realign(tmp_path, entries, stream, comment):
+	path = unaligned(str(tmp_path / "unaligned.apk"), entries, stream, comment)
+	before = contents(path)
+	data = mapped(path)
+	wrong = misaligned(data)
+	data.close()
+	assert wrong
+	assert realign(path) == wrong
+	data = mapped(path)
+	assert misaligned(data) == []
+	data.close()
+	with zipfile.ZipFile(path) as apk:
+		assert apk.testzip() is None
+		assert apk.comment == comment
+	assert contents(path) == before
+	# Nothing is left to do the second time
+	assert realign(path) == []
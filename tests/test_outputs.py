@@ -0,0 +1,121 @@
+import os
+import re
+import json
+import copy
+import pathlib
+import pytest
+from nino.config import running, defaults
+from nino.statics import defconfig
+from nino.project import project
+from nino.outputs import variantoutputs
+
+class baseline():
+	# The original discovery: glob every apk of the project, keep those on gradle output routes and tell new ones with a symmetric difference
+	def __init__(self, app):
+		self.app, self.releases, self.signlist = app, set(), {}
+
+	def updatesignlist(self, task):
+		apks = [str(apk.relative_to(self.app.sources)) for apk in pathlib.Path(self.app.sources).glob("**/*.apk")]
+		validroutes = re.compile(".*build(\\\\|\\/).*outputs(\\\\|\\/).*apk(\\\\|\\/)")
+		previous = copy.deepcopy(self.releases)
+		self.releases = set(filter(validroutes.match, apks))
+		new = previous.symmetric_difference(self.releases)
+		outputs = {}
+		apkroute = re.compile("[^\\\\|\\/]*\\.apk")
+		for apk in new:
+			route = re.sub(apkroute, "", apk)
+			if route not in outputs:
+				outputs[route] = {"apks": [], "splitnames": []}
+			outputs[route]["apks"].append(apk)
+		for route in [route for route in outputs if len(outputs[route]["apks"]) > 1]:
+			previous = outputs[route]["apks"][1].split("-")
+			for apk in outputs[route]["apks"]:
+				current = apk.split("-")
+				differences = [item for item in current if item not in previous]
+				outputs[route]["splitnames"].append("-".join(differences))
+				previous = current
+		for route in outputs:
+			for index, apk in enumerate(outputs[route]["apks"]):
+				displayname = re.split("\\\\|\\/", re.sub(validroutes, "", apk))
+				if len(displayname) == 3:
+					displayname = self.app.name + "-" + task + "-" + displayname[0]
+				else:
+					displayname = self.app.name + "-" + task
+				if len(outputs[route]["apks"]) > 1:
+					displayname = displayname + "-" + outputs[route]["splitnames"][index]
+				self.signlist[apk] = {"displayname": displayname + ".apk", "keystore": self.app.keystore, "keyalias": self.app.keyalias, "deploy": self.app.deploy}
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+	for key, value in defaults.items():
+		monkeypatch.setitem(running, key, copy.deepcopy(value))
+	monkeypatch.setitem(running, "workdir", str(tmp_path))
+	monkeypatch.setitem(running, "projects", {"default": copy.deepcopy(defconfig)})
+	running["projects"]["default"]["tasks"]["debug"] = {"exec": "assembleDebug"}
+	(tmp_path / "app").mkdir()
+	return project("app")
+
+def write(app, route, when):
+	path = os.path.join(app.sources, *route.split("/"))
+	os.makedirs(os.path.dirname(path), exist_ok = True)
+	with open(path, "wb") as file:
+		file.write(b"PK\x05\x06" + b"\0" * 18)
+	os.utime(path, (when, when))
+
+def compare(app, old, task, start):
+	app.updatesignlist(task, start)
+	old.updatesignlist(task)
+	current = {apk: {key: entry[key] for key in ["displayname", "keystore", "keyalias", "deploy"]} for apk, entry in app.signlist.items()}
+	assert current == old.signlist
+	return current
+
+def test_nested_flavours(app):
+	old = baseline(app)
+	write(app, "app/build/outputs/apk/free/release/app-free-release-unsigned.apk", 1000)
+	write(app, "app/build/outputs/apk/paid/release/app-paid-release-unsigned.apk", 1000)
+	write(app, "wear/build/outputs/apk/release/wear-release-unsigned.apk", 1000)
+	signlist = compare(app, old, "release", 500)
+	assert sorted(entry["displayname"] for entry in signlist.values()) == ["app-release-free.apk", "app-release-paid.apk", "app-release.apk"]
+
+def test_split_apks(app):
+	old = baseline(app)
+	for split in ["arm64-v8a", "armeabi-v7a", "x86_64", "universal"]:
+		write(app, "app/build/outputs/apk/release/app-" + split + "-release-unsigned.apk", 1000)
+	signlist = compare(app, old, "release", 500)
+	assert len(signlist) == 4
+	assert len(set(entry["displayname"] for entry in signlist.values())) == 4
+
+def test_outside_gradle_outputs(app):
+	old = baseline(app)
+	write(app, "app/build/outputs/apk/release/app-release-unsigned.apk", 1000)
+	# Neither the git database, the sources nor the intermediates hold task outputs
+	write(app, ".git/lfs/objects/aa/bb/prebuilt.apk", 1000)
+	write(app, "app/src/main/assets/bundled.apk", 1000)
+	write(app, "app/build/intermediates/apk/release/app-release-unsigned.apk", 1000)
+	signlist = compare(app, old, "release", 500)
+	assert list(signlist) == [os.path.join("app", "build", "outputs", "apk", "release", "app-release-unsigned.apk")]
+
+def test_consecutive_tasks(app):
+	old = baseline(app)
+	write(app, "app/build/outputs/apk/free/debug/app-free-debug.apk", 1000)
+	compare(app, old, "debug", 500)
+	app.signlist, old.signlist = {}, {}
+	# The second task only claims what it wrote, even though the first outputs are still there
+	write(app, "app/build/outputs/apk/free/release/app-free-release-unsigned.apk", 3000)
+	write(app, "app/build/outputs/apk/paid/release/app-paid-release-unsigned.apk", 3000)
+	signlist = compare(app, old, "release", 2000)
+	assert sorted(entry["displayname"] for entry in signlist.values()) == ["app-release-free.apk", "app-release-paid.apk"]
+
+def test_aggregate_tasks(app):
+	# Every variant output comes with the metadata gradle leaves next to it
+	for flavour, buildtype in [("free", "debug"), ("free", "release"), ("paid", "release")]:
+		route = "app/build/outputs/apk/" + flavour + "/" + buildtype + "/"
+		write(app, route + "app-" + flavour + "-" + buildtype + ".apk", 1000)
+		with open(os.path.join(app.sources, *route.split("/"), "output-metadata.json"), "w") as file:
+			json.dump({"variantName": flavour + buildtype.capitalize(), "elements": [{"outputFile": "app-" + flavour + "-" + buildtype + ".apk"}]}, file)
+	outputs = lambda task: sorted(os.path.basename(apk) for apk in variantoutputs(app.sources, app.builddir, task))
+	assert outputs("assembleRelease") == ["app-free-release.apk", "app-paid-release.apk"]
+	assert outputs("assembleFree") == ["app-free-debug.apk", "app-free-release.apk"]
+	assert outputs(":app:assembleRelease") == ["app-free-release.apk", "app-paid-release.apk"]
+	assert outputs("assembleFreeRelease") == ["app-free-release.apk"]
+	assert outputs(":wear:assembleRelease") == []